@@ -5,20 +5,87 @@
 """CircleStories
 
 Sets up the app: configures routes, secret key, etc.
+
+Apps are created with `create_app()`. Each app keeps its settings to itself,
+so several can run in one process; the database is only opened by the first
+request that needs it. The one thing shared is instrumentation: with
+INSTRUMENT_QUERIES on, the connection pools of the app's database, which
+everything in the process using that file shares, count their queries.
 """
 
-from os import urandom
+import os
 
 from flask import Flask
 
-app = Flask(__name__)
+from app import auth, metrics, routes
+from app.db import all_pools
+
+DEFAULT_CONFIG = {
+    # Path of the SQLite database
+    "DB_FILE": "circlestories.db",
+    # Directory where images submitted inline are stored (see app.blobs)
+    "BLOB_DIR": "blobs",
+    # Key used to sign sessions. It must be the same in every worker process,
+    # otherwise sessions signed by one worker are rejected by the others.
+    "SECRET_KEY": None,
+    # Number of stories shown per homepage section
+    "PAGE_SIZE": 20,
+    # Upper bound on the total size of rendered stories kept in memory
+    # (in characters)
+    "RENDER_CACHE_SIZE": 32 * 1024 * 1024,
+    # Upper bound on the total size of rendered homepages kept in memory
+    # (in characters)
+    "HOMEPAGE_CACHE_SIZE": 16 * 1024 * 1024,
+    # Write appends and new stories through a single writer thread that
+    # commits them in groups (see app.append_queue)
+    "APPEND_QUEUE": False,
+    # Read stories through read-only connections of their own, so that reads
+    # and writes never share a connection (see app.db)
+    "READ_ONLY_CONNECTIONS": False,
+    # If set, list and search stories from a copy of the database refreshed
+    # this often (in seconds), so the homepage may be that far behind. Each
+    # worker process copies the database on a background thread (when it
+    # has changed) and keeps up to three copies in the temporary directory
+    # (TMPDIR), which may be tmpfs, i.e. RAM
+    "LISTING_SNAPSHOT_MAX_AGE": None,
+    # Scheme and cost used to hash new passwords, e.g. "pbkdf2_sha256$200000"
+    # or "scrypt$16384$8$1". Existing hashes are upgraded on login.
+    "PASSWORD_SCHEME": auth.DEFAULT_PASSWORD_SCHEME,
+    # Count and time every query, serve the totals at /metrics and log slow
+    # queries (see app.metrics)
+    "INSTRUMENT_QUERIES": False,
+    # Queries taking at least this long are logged when instrumented
+    "SLOW_QUERY_MS": 100,
+    # Also report each request's queries in X-Query-* response headers
+    "QUERY_HEADERS": False,
+}
+
+
+def create_app(config=None):
+    """Creates a CircleStories app. Settings are taken from DEFAULT_CONFIG,
+    then from the CIRCLESTORIES_DB, CIRCLESTORIES_SECRET_KEY and
+    CIRCLESTORIES_PASSWORD_SCHEME environment variables, then from `config`."""
+
+    app = Flask(__name__)
+    app.config.update(DEFAULT_CONFIG)
+    if "CIRCLESTORIES_DB" in os.environ:
+        app.config["DB_FILE"] = os.environ["CIRCLESTORIES_DB"]
+    if "CIRCLESTORIES_SECRET_KEY" in os.environ:
+        app.config["SECRET_KEY"] = os.environ["CIRCLESTORIES_SECRET_KEY"]
+    if "CIRCLESTORIES_PASSWORD_SCHEME" in os.environ:
+        app.config["PASSWORD_SCHEME"] = os.environ["CIRCLESTORIES_PASSWORD_SCHEME"]
+    app.config.update(config or {})
 
-# This must be after Flask app init to avoid circular imports
-from app import routes # pylint: disable=wrong-import-position
+    if not app.config["SECRET_KEY"]:
+        # Sessions won't survive a restart or work across worker processes
+        app.config["SECRET_KEY"] = os.urandom(32)
 
-# Secret key for session (32 random bytes)
-app.secret_key = urandom(32)
+    # Fails early on a malformed PASSWORD_SCHEME
+    app.extensions["password_scheme"] = auth.make_scheme(app.config["PASSWORD_SCHEME"])
 
-# This should be false in prod
-app.debug = True
-app.run()
+    app.register_blueprint(routes.bp)
+    if app.config["INSTRUMENT_QUERIES"]:
+        for pool in all_pools(app.config["DB_FILE"]):
+            pool.cursor_factory = metrics.InstrumentedCursor
+        app.register_blueprint(metrics.bp)
+    return app
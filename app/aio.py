@@ -0,0 +1,111 @@
+# CircleTable — Christopher Liu, Yusuf Elsharawy, Deven Maheshwari, Naomi Naranjo
+# SoftDev
+# P00: CircleStories
+
+"""Async Database Access
+
+Async versions of the StoryDB and auth calls for use from async code, such as
+the ASGI adapter in `app.asgi`. Every call runs on a bounded thread pool, so
+the event loop never waits on SQLite and at most MAX_WORKERS database
+connections are in use at once.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import functools
+
+from app import auth
+
+# Each worker thread uses at most one pooled connection at a time (see app.db)
+MAX_WORKERS = 16
+
+EXECUTOR = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="db")
+
+
+async def run_in_pool(func, *args, **kwargs):
+    """Runs `func(*args, **kwargs)` on the database thread pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        EXECUTOR, functools.partial(func, *args, **kwargs)
+    )
+
+
+class AsyncStoryDB:
+    """Async facade over a StoryDB. Story DAOs returned by it are the usual
+    synchronous ones; use the methods here to query through them."""
+
+    def __init__(self, story_db):
+        self.story_db = story_db
+
+    async def get_story(self, story_id):
+        """See StoryDB.get_story."""
+        return await run_in_pool(self.story_db.get_story, story_id)
+
+    async def add_story(self, creator_id, title):
+        """See StoryDB.add_story."""
+        return await run_in_pool(self.story_db.add_story, creator_id, title)
+
+    async def is_contributor(self, user_id, story_id):
+        """See StoryDB.is_contributor."""
+        return await run_in_pool(self.story_db.is_contributor, user_id, story_id)
+
+    async def list_stories(self, user_id, contributed, after=None, limit=None):
+        """See StoryDB.list_stories."""
+        return await run_in_pool(
+            self.story_db.list_stories, user_id, contributed, after, limit
+        )
+
+    @staticmethod
+    async def get_blocks(story_obj):
+        """See StoryDB.Story.get_blocks."""
+        return await run_in_pool(story_obj.get_blocks)
+
+    @staticmethod
+    async def get_contributors(story_obj):
+        """See StoryDB.Story.get_contributors."""
+        return await run_in_pool(story_obj.get_contributors)
+
+    @staticmethod
+    async def last_block(story_obj):
+        """See StoryDB.Story.last_block."""
+        return await run_in_pool(story_obj.last_block)
+
+    @staticmethod
+    async def add_block(story_obj, author_id, block_text, block_img):
+        """See StoryDB.Story.add_block."""
+        return await run_in_pool(story_obj.add_block, author_id, block_text, block_img)
+
+
+async def authenticate_user(username, password):
+    """See auth.authenticate_user. The password is checked on the password
+    hashing pool directly, so no database thread waits for it."""
+    stored = await run_in_pool(auth.get_password_hash, username)
+    if stored is None:
+        return False
+
+    loop = asyncio.get_running_loop()
+    matches, new_hash = await loop.run_in_executor(
+        auth.KDF_EXECUTOR,
+        auth.check_password,
+        password,
+        stored,
+        auth.current_password_scheme(),
+    )
+    if new_hash is not None:
+        await run_in_pool(auth.replace_password_hash, username, stored, new_hash)
+    return matches
+
+
+async def create_user(username, password, password_check):
+    """See auth.create_user."""
+    return await run_in_pool(auth.create_user, username, password, password_check)
+
+
+async def get_user_id(username):
+    """See auth.get_user_id."""
+    return await run_in_pool(auth.get_user_id, username)
+
+
+async def get_username(user_id):
+    """See auth.get_username."""
+    return await run_in_pool(auth.get_username, user_id)
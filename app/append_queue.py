@@ -0,0 +1,115 @@
+# CircleTable — Christopher Liu, Yusuf Elsharawy, Deven Maheshwari, Naomi Naranjo
+# SoftDev
+# P00: CircleStories
+
+"""Append Queue
+
+An optional single writer for appends and new stories. Request threads hand
+their writes to one writer thread, which commits every write that queued up
+while it was busy in a single transaction (group commit), instead of each
+request taking the write lock and committing on its own.
+
+Each write runs in its own savepoint, so one failing write doesn't undo the
+others, and a request is only answered once the transaction holding its
+write has committed. The writer's connection uses synchronous=FULL, so that
+commit is durable; grouping makes that affordable.
+
+Enabled with the APPEND_QUEUE setting. Each worker process has its own queue;
+writers in different processes still take turns through the write lock.
+"""
+
+from concurrent.futures import Future
+import queue
+import threading
+
+# Maximum number of writes committed in one transaction
+MAX_BATCH_SIZE = 256
+
+# Put on the queue to stop the writer thread
+STOP = object()
+
+
+class AppendQueue:
+    """Runs write operations for a StoryDB on a single writer thread, in
+    grouped transactions."""
+
+    def __init__(self, story_db, max_batch_size=MAX_BATCH_SIZE):
+        self.story_db = story_db
+        self.max_batch_size = max_batch_size
+        self.transactions = 0
+        self.writes = 0
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(
+            target=self.run, name="append-writer", daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, operation):
+        """Queues `operation(cur)` to run in a write transaction and returns
+        a Future for its result, set once the transaction has committed."""
+        future = Future()
+        self._queue.put((operation, future))
+        return future
+
+    def write(self, operation):
+        """Like StoryDB.write: runs `operation(cur)` in a write transaction
+        and returns its result once it has committed."""
+        return self.submit(operation).result()
+
+    def close(self):
+        """Stops the writer thread once everything queued has been written."""
+        self._queue.put(STOP)
+        self._thread.join()
+
+    def run(self):
+        """The writer thread: commits queued writes in batches."""
+        with self.story_db.connect() as cur:
+            cur.execute("PRAGMA synchronous=FULL")
+
+        while True:
+            batch = [self._queue.get()]
+            # Everything that queued up during the last commit goes together
+            while len(batch) < self.max_batch_size and batch[-1] is not STOP:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stopping = batch[-1] is STOP
+            if stopping:
+                batch.pop()
+            if batch:
+                self.commit(batch)
+            if stopping:
+                return
+
+    def commit(self, batch):
+        """Runs a batch of (operation, future) pairs in one transaction, then
+        resolves their futures."""
+
+        def operation(cur):
+            outcomes = []
+            for item_operation, _ in batch:
+                cur.execute("SAVEPOINT append_item")
+                try:
+                    outcomes.append((True, item_operation(cur)))
+                except Exception as error:  # pylint: disable=broad-except
+                    cur.execute("ROLLBACK TO append_item")
+                    outcomes.append((False, error))
+                cur.execute("RELEASE append_item")
+            return outcomes
+
+        try:
+            outcomes = self.story_db.write(operation)
+        except Exception as error:  # pylint: disable=broad-except
+            for _, future in batch:
+                future.set_exception(error)
+            return
+
+        self.transactions += 1
+        self.writes += len(batch)
+        for (_, future), (succeeded, outcome) in zip(batch, outcomes):
+            if succeeded:
+                future.set_result(outcome)
+            else:
+                future.set_exception(outcome)
@@ -0,0 +1,206 @@
+# CircleTable — Christopher Liu, Yusuf Elsharawy, Deven Maheshwari, Naomi Naranjo
+# SoftDev
+# P00: CircleStories
+
+"""Story Archives
+
+Dumps a database's users, stories and blocks to JSON Lines and loads them
+back, for backups, migrations and seeding other environments:
+
+    python3 -m app.archive export circlestories.db archive.jsonl.gz
+    python3 -m app.archive import restored.db archive.jsonl.gz
+
+Each line is one row, e.g. {"type": "block", "block_id": ..., ...}. Files
+ending in .gz are compressed, and "-" means stdin/stdout. Both directions
+stream rows in batches, so memory use doesn't grow with the archive.
+Password hashes are included, so keep archives private. Images in the blob
+store are referenced, not copied; copy BLOB_DIR along with the archive.
+
+An import goes into an empty database, in a single transaction: the indexes
+and triggers are dropped, the rows are inserted with executemany, and then
+the indexes, triggers and everything derived from the blocks (the stories'
+counters and last blocks, contributors and full-text search) are rebuilt in
+one pass each.
+"""
+
+import argparse
+from contextlib import nullcontext
+import gzip
+import json
+import sys
+
+from app.storydb import StoryDB
+
+# Columns of each kind of row, in the order they are exported and inserted
+FIELDS = {
+    "user": ("user_id", "username", "password"),
+    "story": ("story_id", "creator_id", "title", "creation_timestamp"),
+    "block": (
+        "block_id",
+        "story_id",
+        "author_id",
+        "position",
+        "block_text",
+        "block_img",
+        "creation_timestamp",
+    ),
+}
+
+TABLES = {"user": "users", "story": "stories", "block": "blocks"}
+
+# Rows fetched or inserted at a time
+BATCH_SIZE = 10000
+
+EXPORT_QUERIES = {
+    kind: f"SELECT {', '.join(fields)} FROM {TABLES[kind]} ORDER BY rowid"
+    for kind, fields in FIELDS.items()
+}
+
+# Recomputes what the app keeps up to date on every append, after an import
+REBUILD_STATEMENTS = (
+    "INSERT INTO stories_fts(stories_fts) VALUES ('rebuild')",
+    "INSERT INTO blocks_fts(blocks_fts) VALUES ('rebuild')",
+    """INSERT OR IGNORE INTO story_contributors(user_id, story_id)
+    SELECT author_id, story_id FROM blocks WHERE author_id IS NOT NULL""",
+    # Positions are dense, so the last block's position gives the count
+    """UPDATE stories SET (
+        num_blocks, last_block_id, last_block_text, last_block_img,
+        last_block_timestamp
+    ) = (
+        SELECT position + 1, block_id, block_text, block_img, creation_timestamp
+        FROM blocks WHERE blocks.story_id = stories.story_id
+        ORDER BY position DESC LIMIT 1
+    )
+    WHERE EXISTS (SELECT TRUE FROM blocks WHERE blocks.story_id = stories.story_id)""",
+    # The triggers that count changes were dropped during the import, and
+    # anything cached before it is out of date
+    "UPDATE meta SET value = value + 1 WHERE name = 'story_version'",
+)
+
+
+def open_archive(path, mode):
+    """Opens an archive for reading ("r") or writing ("w") as text."""
+    if path == "-":
+        # Left open when the archive is closed
+        return nullcontext(sys.stdin if mode == "r" else sys.stdout)
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", compresslevel=6, encoding="utf8")
+    return open(path, mode, encoding="utf8")
+
+
+def export_archive(story_db, file):
+    """Writes every user, story and block to `file` and returns how many rows
+    of each kind were written. Everything is read in one transaction, so the
+    archive is consistent even while the app keeps writing."""
+    counts = dict.fromkeys(FIELDS, 0)
+    with story_db.read() as cur:
+        cur.execute("BEGIN")
+        for kind, fields in FIELDS.items():
+            cur.execute(EXPORT_QUERIES[kind])
+            while True:
+                rows = cur.fetchmany(BATCH_SIZE)
+                if not rows:
+                    break
+                file.writelines(
+                    json.dumps({"type": kind, **dict(zip(fields, row))}) + "\n"
+                    for row in rows
+                )
+                counts[kind] += len(rows)
+    return counts
+
+
+def import_archive(story_db, file):
+    """Loads the rows of an archive into an empty database and returns how
+    many of each kind were loaded. Nothing is loaded if anything fails."""
+    with story_db.connect() as cur:
+        # Building the indexes sorts every row, which shouldn't happen in RAM
+        cur.execute("PRAGMA temp_store=FILE")
+    try:
+        return load_rows(story_db, file)
+    finally:
+        with story_db.connect() as cur:
+            cur.execute("PRAGMA temp_store=MEMORY")
+
+
+def load_rows(story_db, file):
+    """Does the work of `import_archive`."""
+    counts = dict.fromkeys(FIELDS, 0)
+    with story_db.connect() as cur:
+        cur.execute("BEGIN IMMEDIATE")
+        cur.execute("""SELECT EXISTS (SELECT TRUE FROM users)
+            OR EXISTS (SELECT TRUE FROM stories)""")
+        if cur.fetchone()[0]:
+            raise ValueError(f"{story_db.db_file} already has users or stories")
+
+        # Maintaining indexes and triggers row by row is much slower than
+        # building them once at the end
+        cur.execute("""SELECT type, name, sql FROM sqlite_master
+            WHERE type IN ('index', 'trigger') AND sql IS NOT NULL""")
+        deferred = cur.fetchall()
+        for kind, name, _ in deferred:
+            cur.execute(f'DROP {kind.upper()} "{name}"')
+
+        batches = {kind: [] for kind in FIELDS}
+        for line in file:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            kind = row.get("type")
+            if kind not in FIELDS:
+                raise ValueError(f"Unknown row type {kind!r}")
+            batch = batches[kind]
+            batch.append(tuple(row.get(field) for field in FIELDS[kind]))
+            if len(batch) >= BATCH_SIZE:
+                insert_rows(cur, kind, batch)
+                counts[kind] += len(batch)
+                batch.clear()
+        for kind, batch in batches.items():
+            insert_rows(cur, kind, batch)
+            counts[kind] += len(batch)
+
+        for _, _, sql in deferred:
+            cur.execute(sql)
+        for statement in REBUILD_STATEMENTS:
+            cur.execute(statement)
+    return counts
+
+
+def insert_rows(cur, kind, rows):
+    """Inserts a batch of rows of one kind."""
+    fields = FIELDS[kind]
+    cur.executemany(
+        f"""INSERT INTO {TABLES[kind]} ({", ".join(fields)})
+        VALUES ({", ".join("?" * len(fields))})""",
+        rows,
+    )
+
+
+def main():
+    """Parses the command line and runs the export or import."""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("command", choices=("export", "import"))
+    parser.add_argument("db_file")
+    parser.add_argument("archive", help='archive file, or "-" for stdin/stdout')
+    args = parser.parse_args()
+
+    story_db = StoryDB(args.db_file)
+    if args.command == "export":
+        with open_archive(args.archive, "w") as file:
+            counts = export_archive(story_db, file)
+    else:
+        with open_archive(args.archive, "r") as file:
+            try:
+                counts = import_archive(story_db, file)
+            except ValueError as error:
+                sys.exit(f"Import failed: {error}")
+    print(
+        f"{args.command}ed {counts['user']} users, {counts['story']} stories "
+        f"and {counts['block']} blocks",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+# CircleTable — Christopher Liu, Yusuf Elsharawy, Deven Maheshwari, Naomi Naranjo
+# SoftDev
+# P00: CircleStories
+
+"""ASGI Serving Mode
+
+Serves CircleStories from an ASGI server, e.g.
+
+    uvicorn app.asgi:application
+
+The app is configured from the environment (see `create_app`).
+
+Each request runs the Flask app on the bounded database thread pool from
+`app.aio`, so a single process serves many concurrent readers while the event
+loop only moves bytes. The response is streamed back chunk by chunk,
+through a bounded queue: a worker that gets ahead of a slow client waits for
+it, and one whose client has gone away stops rendering.
+
+A worker stays busy until its whole response has been sent, so at most
+`app.aio.MAX_WORKERS` requests are handled at once, counting those waiting on
+slow clients; the rest wait for a free worker.
+"""
+
+import asyncio
+import concurrent.futures
+from io import BytesIO
+import logging
+import sys
+import threading
+
+from app import create_app
+from app.aio import EXECUTOR
+
+LOGGER = logging.getLogger(__name__)
+
+# Marks the end of a response on the queue between the worker and the loop
+DONE = object()
+
+# Number of response chunks a worker may get ahead of the client by
+QUEUE_SIZE = 8
+
+# How often (in seconds) a worker waiting for room on the queue checks
+# whether the response was abandoned
+PUT_POLL_INTERVAL = 0.1
+
+
+def build_environ(scope, body):
+    """Translates an ASGI HTTP scope and request body into a WSGI environ."""
+    server_name, server_port = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf8").decode("latin1"),
+        "PATH_INFO": scope["path"].encode("utf8").decode("latin1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin1"),
+        "SERVER_NAME": server_name,
+        "SERVER_PORT": str(server_port),
+        "SERVER_PROTOCOL": "HTTP/" + scope.get("http_version", "1.1"),
+        "REMOTE_ADDR": (scope.get("client") or ("", 0))[0],
+        # The whole body has been read already, so its length is known
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for raw_name, raw_value in scope.get("headers", []):
+        name = raw_name.decode("latin1").upper().replace("-", "_")
+        value = raw_value.decode("latin1")
+        if name == "CONTENT_LENGTH":
+            continue
+        if name != "CONTENT_TYPE":
+            name = "HTTP_" + name
+        if name in environ:
+            separator = "; " if name == "HTTP_COOKIE" else ","
+            value = environ[name] + separator + value
+        environ[name] = value
+    return environ
+
+
+class AsgiAdapter:
+    """Wraps a WSGI app so that it can be served over ASGI. The WSGI app and
+    its response iterator run on `executor`, in a single thread per request,
+    because a thread keeps the connection it checked out (see app.db) and its
+    Flask contexts until the response is done."""
+
+    def __init__(self, wsgi_app, executor=EXECUTOR):
+        self.wsgi_app = wsgi_app
+        self.executor = executor
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await AsgiAdapter.lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            raise ValueError(f"Unsupported ASGI scope type {scope['type']!r}")
+
+        body = b""
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        # Set once nobody will read the queue anymore
+        gone = threading.Event()
+
+        def put(item):
+            """Waits for room on the queue and puts `item` on it. Returns
+            False instead if the response was abandoned."""
+            if gone.is_set():
+                return False
+            future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+            while True:
+                try:
+                    future.result(PUT_POLL_INTERVAL)
+                    return True
+                except concurrent.futures.TimeoutError:
+                    if gone.is_set():
+                        future.cancel()
+                        return False
+
+        loop.run_in_executor(
+            self.executor, self.run_wsgi, build_environ(scope, body), put
+        )
+        disconnected = asyncio.ensure_future(AsgiAdapter.disconnect(receive))
+        try:
+            await AsgiAdapter.send_response(queue, disconnected, send)
+        finally:
+            # Also reached if `send` fails or the request is cancelled
+            gone.set()
+            disconnected.cancel()
+
+    @staticmethod
+    async def send_response(queue, disconnected, send):
+        """Sends what the worker puts on `queue` until it is DONE, or until
+        the `disconnected` future says the client went away."""
+        started = False
+        getter = None
+        while True:
+            if getter is None:
+                getter = asyncio.ensure_future(queue.get())
+            await asyncio.wait(
+                (getter, disconnected), return_when=asyncio.FIRST_COMPLETED
+            )
+            if disconnected.done():
+                if disconnected.exception() is None:
+                    getter.cancel()
+                    return
+                # The server's receive() failed, which says nothing about
+                # the client, so the response is still sent
+                LOGGER.error(
+                    "Couldn't watch for disconnects",
+                    exc_info=disconnected.exception(),
+                )
+                disconnected = asyncio.get_running_loop().create_future()
+            if not getter.done():
+                continue
+            item = getter.result()
+            getter = None
+            if item is DONE:
+                break
+            if isinstance(item, BaseException):
+                if started:
+                    raise item
+                await send(
+                    {
+                        "type": "http.response.start",
+                        "status": 500,
+                        "headers": [(b"content-type", b"text/plain")],
+                    }
+                )
+                await send({"type": "http.response.body", "body": b"Server Error"})
+                return
+            if isinstance(item, dict):
+                started = True
+                await send(item)
+            else:
+                await send(
+                    {"type": "http.response.body", "body": item, "more_body": True}
+                )
+        await send({"type": "http.response.body", "body": b""})
+
+    @staticmethod
+    async def disconnect(receive):
+        """Returns once the client has disconnected."""
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    def run_wsgi(self, environ, put):
+        """Runs the WSGI app in a worker thread, passing the response start
+        message, body chunks and finally DONE (or an exception) to `put`.
+        Stops early if `put` returns False (nobody is listening anymore)."""
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info:
+                raise exc_info[1].with_traceback(exc_info[2])
+            put(
+                {
+                    "type": "http.response.start",
+                    "status": int(status.split(" ", 1)[0]),
+                    "headers": [
+                        (name.lower().encode("latin1"), value.encode("latin1"))
+                        for name, value in headers
+                    ],
+                }
+            )
+
+        try:
+            result = self.wsgi_app(environ, start_response)
+            try:
+                for chunk in result:
+                    if chunk and not put(chunk):
+                        break
+            finally:
+                if hasattr(result, "close"):
+                    result.close()
+        except Exception as error:  # pylint: disable=broad-except
+            put(error)
+            return
+        put(DONE)
+
+    @staticmethod
+    async def lifespan(receive, send):
+        """Acknowledges ASGI server startup and shutdown."""
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+application = AsgiAdapter(create_app())
@@ -6,27 +6,193 @@
 
 Handles all of the login/registration functionality for CircleStories
 including input validation.
+
+Passwords are stored as `<scheme>$<params...>$<salt>$<hash>`, e.g.
+`pbkdf2_sha256$200000$<salt>$<hash>`, except for old unsalted SHA-512 hashes,
+which are bare hex digests. Hashes that don't use the configured scheme and
+parameters are replaced the next time their user logs in.
 """
 
+import abc
+from concurrent.futures import ThreadPoolExecutor
 import hashlib
+import hmac
+import os
 import sqlite3
 
+from flask import current_app, has_app_context
+
+from app.cache import LRUCache
+from app.db import get_pool
+
+# Database used outside of an app (by scripts and benchmarks). Inside one,
+# its DB_FILE setting is used instead.
 DB_FILE = "circlestories.db"
 
+# Scheme and cost parameters used to hash new passwords, in the format of the
+# start of a stored hash. Apps take theirs from the PASSWORD_SCHEME setting.
+DEFAULT_PASSWORD_SCHEME = "pbkdf2_sha256$200000"
+
+# Bytes of random salt in each new hash
+SALT_SIZE = 16
+
+# Password hashing runs on its own pool of at most one thread per core, so a
+# burst of logins queues up there instead of taking every core away from the
+# requests that don't hash anything. (hashlib releases the GIL while hashing.)
+KDF_WORKERS = os.cpu_count() or 1
+KDF_EXECUTOR = ThreadPoolExecutor(max_workers=KDF_WORKERS, thread_name_prefix="kdf")
+
+# Maximum number of users remembered in each direction. Usernames and ids
+# never change, so cached entries never go stale.
+USER_CACHE_SIZE = 10000
+
+# (db_file, username) -> user_id and (db_file, user_id) -> username
+USER_IDS = LRUCache(USER_CACHE_SIZE, sizeof=lambda _: 1)
+USERNAMES = LRUCache(USER_CACHE_SIZE, sizeof=lambda _: 1)
+
+
+class PasswordScheme(abc.ABC):
+    """A way of hashing passwords, along with its cost parameters. Subclasses
+    set `name` and implement `derive`."""
+
+    name = None
+
+    def __init__(self, *params):
+        self.params = tuple(int(param) for param in params)
+
+    @property
+    def prefix(self) -> str:
+        """The start of every hash made with this scheme and parameters."""
+        return "$".join((self.name,) + tuple(map(str, self.params)))
+
+    @abc.abstractmethod
+    def derive(self, password: bytes, salt: bytes) -> bytes:
+        """Returns the hash of a password with the given salt."""
+
+    def encode(self, password: str) -> str:
+        """Hashes a password with a new random salt, in the stored format."""
+        salt = os.urandom(SALT_SIZE)
+        password_hash = self.derive(password.encode(), salt)
+        return f"{self.prefix}${salt.hex()}${password_hash.hex()}"
+
+
+class Pbkdf2Sha256(PasswordScheme):
+    """PBKDF2-HMAC-SHA256. Parameters: iterations."""
+
+    name = "pbkdf2_sha256"
+
+    def derive(self, password: bytes, salt: bytes) -> bytes:
+        (iterations,) = self.params
+        return hashlib.pbkdf2_hmac("sha256", password, salt, iterations)
+
+
+class Scrypt(PasswordScheme):
+    """scrypt. Parameters: n (CPU/memory cost), r (block size) and p
+    (parallelization)."""
+
+    name = "scrypt"
+
+    def derive(self, password: bytes, salt: bytes) -> bytes:
+        cost, block_size, parallelization = self.params
+        return hashlib.scrypt(
+            password,
+            salt=salt,
+            n=cost,
+            r=block_size,
+            p=parallelization,
+            # scrypt needs 128 * n * r bytes, plus some room
+            maxmem=256 * cost * block_size + 1024 * 1024,
+            dklen=32,
+        )
+
+
+class LegacySha512(PasswordScheme):
+    """Unsalted SHA-512, as used before hashes had a scheme. Only ever used to
+    check old hashes."""
+
+    name = "sha512"
+
+    def derive(self, password: bytes, salt: bytes) -> bytes:
+        return hashlib.sha512(password).digest()
+
+
+# Schemes that can be configured for new hashes, by name
+PASSWORD_SCHEMES = {scheme.name: scheme for scheme in (Pbkdf2Sha256, Scrypt)}
+
+
+def make_scheme(spec: str) -> PasswordScheme:
+    """Returns the scheme described by a string like "scrypt$16384$8$1"."""
+
+    name, *params = spec.split("$")
+    return PASSWORD_SCHEMES[name](*params)
+
+
+# Scheme used outside of an app, like DB_FILE
+PASSWORD_SCHEME = make_scheme(DEFAULT_PASSWORD_SCHEME)
+
+
+def current_db_file() -> str:
+    """Returns the database of the current app, or DB_FILE outside of one."""
+
+    return current_app.config["DB_FILE"] if has_app_context() else DB_FILE
+
+
+def current_password_scheme() -> PasswordScheme:
+    """Returns the scheme the current app hashes new passwords with, or
+    PASSWORD_SCHEME outside of one."""
+
+    if not has_app_context():
+        return PASSWORD_SCHEME
+    extensions = current_app.extensions
+    if "password_scheme" not in extensions:
+        extensions["password_scheme"] = make_scheme(
+            current_app.config["PASSWORD_SCHEME"]
+        )
+    return extensions["password_scheme"]
+
+
+def parse_hash(stored: str) -> tuple:
+    """Splits a stored hash into its (scheme, salt, hash). Raises KeyError or
+    ValueError if it isn't in a known format."""
+
+    if "$" not in stored:
+        return LegacySha512(), b"", bytes.fromhex(stored)
+    name, *params, salt, password_hash = stored.split("$")
+    return (
+        PASSWORD_SCHEMES[name](*params),
+        bytes.fromhex(salt),
+        bytes.fromhex(password_hash),
+    )
+
 
 def hash_password(password: str) -> str:
-    """Hashes the provided password using SHA512."""
+    """Hashes the provided password with the configured scheme, on the
+    password hashing pool."""
 
-    return hashlib.sha512(password.encode()).hexdigest()
+    return KDF_EXECUTOR.submit(current_password_scheme().encode, password).result()
 
 
-def validate_registration(username: str, password: str, password_check: str) -> list:
-    """Validates input for new user creation."""
+def check_password(password: str, stored: str, current: PasswordScheme) -> tuple:
+    """Checks a password against a stored hash. Returns whether it matches,
+    and if it does but the hash doesn't use the `current` scheme, a new hash
+    to replace it with (otherwise None). This is slow, so run it on
+    KDF_EXECUTOR."""
 
-    with sqlite3.connect(DB_FILE) as db:
+    try:
+        scheme, salt, password_hash = parse_hash(stored)
+    except (KeyError, ValueError):
+        return False, None
+    if not hmac.compare_digest(scheme.derive(password.encode(), salt), password_hash):
+        return False, None
+    if scheme.prefix == current.prefix:
+        return True, None
+    return True, current.encode(password)
 
-        c = db.cursor()
 
+def validate_registration(username: str, password: str, password_check: str) -> list:
+    """Validates input for new user creation."""
+
+    with get_pool(current_db_file()).connect() as c:
         errors = []
         if len(username) == 0:
             errors.append("Username is required")
@@ -52,63 +218,85 @@ def validate_registration(username: str, password: str, password_check: str) ->
 def create_user(username: str, password: str, password_check: str) -> list:
     """Validates inputs and creates a new user if all inputs are valid."""
 
-    with sqlite3.connect(DB_FILE) as db:
-        c = db.cursor()
-
-        c.execute(
-            """
-            CREATE TABLE IF NOT EXISTS users(
-                user_id     TEXT PRIMARY KEY DEFAULT (hex(randomblob(8))),
-                username    TEXT,
-                password    TEXT
-            )
-        """
-        )
+    errors = validate_registration(username, password, password_check)
+    if errors:
+        return errors
 
-        errors = validate_registration(username, password, password_check)
-        if not errors:
-            password_hash = hash_password(password)
+    # Hashing is slow, so it happens before the write transaction begins
+    password_hash = hash_password(password)
+    with get_pool(current_db_file()).connect() as c:
+        try:
             c.execute(
                 "INSERT INTO users(username, password) VALUES (?, ?)",
                 (username, password_hash),
             )
+        except sqlite3.IntegrityError:
+            # Someone else registered the same name since it was validated
+            return ["Username already in use"]
+        user_id = c.execute(
+            "SELECT user_id FROM users WHERE rowid=last_insert_rowid() LIMIT 1"
+        ).fetchone()[0]
+    # Only once the user is committed, so the cache never names a user that
+    # a failed commit rolled back
+    cache_user(user_id, username)
 
-        return errors
-
+    return errors
 
-def authenticate_user(username: str, password: str) -> bool:
-    """Authenticates a user using the given credentials."""
 
-    with sqlite3.connect(DB_FILE) as db:
-        c = db.cursor()
-
-        if not c.execute(
-            "SELECT name FROM sqlite_master WHERE type='table' AND name='users';"
-        ).fetchone():
-            return False
+def get_password_hash(username: str) -> str:
+    """Returns the stored password hash of a user, None if user doesn't
+    exist."""
 
+    with get_pool(current_db_file()).connect() as c:
         user_pw = c.execute(
             "SELECT password FROM users WHERE username=:username",
             {"username": username},
         ).fetchone()
-        if user_pw is not None and user_pw[0] == hash_password(password):
-            return True
+        return None if user_pw is None else user_pw[0]
+
+
+def replace_password_hash(username: str, old_hash: str, new_hash: str):
+    """Replaces a user's password hash, unless it changed since `old_hash` was
+    read (e.g. another login already rehashed it)."""
+
+    with get_pool(current_db_file()).connect() as c:
+        c.execute(
+            "UPDATE users SET password=? WHERE username=? AND password=?",
+            (new_hash, username, old_hash),
+        )
+
 
+def authenticate_user(username: str, password: str) -> bool:
+    """Authenticates a user using the given credentials. Outdated password
+    hashes are upgraded along the way."""
+
+    stored = get_password_hash(username)
+    if stored is None:
         return False
 
+    matches, new_hash = KDF_EXECUTOR.submit(
+        check_password, password, stored, current_password_scheme()
+    ).result()
+    if new_hash is not None:
+        replace_password_hash(username, stored, new_hash)
+    return matches
+
 
 def get_user_id(username: str) -> str:
     """Returns the user ID associated with the given username, None if user
     doesn't exist."""
 
-    with sqlite3.connect(DB_FILE) as db:
-        c = db.cursor()
+    cached = USER_IDS.get((current_db_file(), username))
+    if cached is not None:
+        return cached
 
+    with get_pool(current_db_file()).connect() as c:
         user_id = c.execute(
             "SELECT user_id FROM users WHERE username=:username", {"username": username}
         ).fetchone()
 
         if user_id is not None:
+            cache_user(user_id[0], username)
             return user_id[0]
         return None
 
@@ -117,13 +305,42 @@ def get_username(user_id: str) -> str:
     """Returns the username associated with the given user_id, None if user
     doesn't exist."""
 
-    with sqlite3.connect(DB_FILE) as db:
-        c = db.cursor()
+    cached = USERNAMES.get((current_db_file(), user_id))
+    if cached is not None:
+        return cached
 
+    with get_pool(current_db_file()).connect() as c:
         username = c.execute(
             "SELECT username FROM users WHERE user_id=:user_id", {"user_id": user_id}
         ).fetchone()
 
         if username is not None:
+            cache_user(user_id, username[0])
             return username[0]
         return None
+
+
+def cache_user(user_id: str, username: str):
+    """Remembers a user_id/username pair of the current database in both
+    directions."""
+
+    db_file = current_db_file()
+    USER_IDS.set((db_file, username), user_id)
+    USERNAMES.set((db_file, user_id), username)
+
+
+def clear_user_cache():
+    """Forgets every cached user, e.g. after replacing a database file."""
+
+    USER_IDS.clear()
+    USERNAMES.clear()
+
+
+def user_cache_stats() -> dict:
+    """Returns the hit and miss counts of the user cache."""
+
+    return {
+        "hits": USER_IDS.hits + USERNAMES.hits,
+        "misses": USER_IDS.misses + USERNAMES.misses,
+        "size": len(USER_IDS) + len(USERNAMES),
+    }
@@ -0,0 +1,139 @@
+# CircleTable — Christopher Liu, Yusuf Elsharawy, Deven Maheshwari, Naomi Naranjo
+# SoftDev
+# P00: CircleStories
+
+"""Blob Store
+
+Keeps images submitted inline as `data:` URIs out of the database. Each image
+is stored once on disk under the SHA-256 of its bytes, and the block only
+keeps a short `blob:<sha256>.<ext>` reference to it, which is served by the
+/image route.
+
+Run `python3 -m app.blobs [db_file] [blob_dir]` to move images that were
+stored inline before this existed.
+"""
+
+import base64
+import binascii
+import hashlib
+import os
+import re
+import sys
+import tempfile
+
+from app.storydb import StoryDB
+
+# Prefix of the block_img values that refer to a stored blob
+BLOB_PREFIX = "blob:"
+
+# Inline images worth storing as blobs. SVG is left alone on purpose: served
+# from our own origin, it could run scripts.
+IMAGE_TYPES = {
+    "image/png": "png",
+    "image/jpeg": "jpg",
+    "image/gif": "gif",
+    "image/webp": "webp",
+}
+
+DATA_URI = re.compile(r"data:(image/[a-z+.-]+);base64,(.*)", re.DOTALL)
+BLOB_NAME = re.compile(r"[0-9a-f]{64}\.(" + "|".join(IMAGE_TYPES.values()) + ")")
+
+# Number of blocks rewritten per transaction by `externalize_all`
+BACKFILL_BATCH_SIZE = 200
+
+
+class BlobStore:
+    """A directory of immutable files named after the hash of their
+    contents, sharded into subdirectories by the first two hex digits."""
+
+    def __init__(self, root):
+        # Absolute, since Flask's send_file resolves relative paths against
+        # the app's package rather than the working directory
+        self.root = os.path.abspath(root)
+
+    def path(self, name):
+        """Returns the path of the blob with this name (its hash and
+        extension), or None if there is no such blob."""
+        if not BLOB_NAME.fullmatch(name):
+            return None
+        path = os.path.join(self.root, name[:2], name)
+        return path if os.path.exists(path) else None
+
+    def put(self, data, extension):
+        """Stores `data` unless it is already stored and returns its name.
+        The file is written under a temporary name and then renamed, so a
+        blob is never seen half written, even by other processes."""
+        name = f"{hashlib.sha256(data).hexdigest()}.{extension}"
+        directory = os.path.join(self.root, name[:2])
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            return name
+
+        os.makedirs(directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=directory, delete=False) as file:
+            file.write(data)
+        os.replace(file.name, path)
+        return name
+
+    def externalize(self, block_img):
+        """Returns what to store as a block's block_img: a blob reference if
+        it is an inline image, otherwise `block_img` unchanged (e.g. links to
+        images elsewhere)."""
+        match = DATA_URI.fullmatch(block_img.strip())
+        if match is None or match.group(1) not in IMAGE_TYPES:
+            return block_img
+        try:
+            data = base64.b64decode("".join(match.group(2).split()), validate=True)
+        except binascii.Error:
+            return block_img
+        return BLOB_PREFIX + self.put(data, IMAGE_TYPES[match.group(1)])
+
+
+def externalize_all(story_db, blob_store):
+    """Moves every inline image in the database into the blob store and
+    returns how many blocks and bytes were moved. The copy of a story's last
+    block on its row is rewritten in the same transaction as the block."""
+    moved_blocks = moved_bytes = 0
+    last_rowid = 0
+    while True:
+        with story_db.connect() as cur:
+            cur.execute(
+                """SELECT rowid, block_id, story_id, block_img FROM blocks
+                WHERE rowid > ? AND block_img LIKE 'data:%'
+                ORDER BY rowid LIMIT ?""",
+                (last_rowid, BACKFILL_BATCH_SIZE),
+            )
+            rows = cur.fetchall()
+        if not rows:
+            return moved_blocks, moved_bytes
+        last_rowid = rows[-1][0]
+
+        updates = []
+        for rowid, block_id, story_id, block_img in rows:
+            reference = blob_store.externalize(block_img)
+            if reference != block_img:
+                updates.append((reference, rowid, story_id, block_id))
+                moved_bytes += len(block_img)
+        story_db.write(lambda cur, updates=updates: rewrite_images(cur, updates))
+        moved_blocks += len(updates)
+
+
+def rewrite_images(cur, updates):
+    """Sets the block_img of blocks given as (block_img, rowid, story_id,
+    block_id), along with the last_block_img of the stories they are the
+    last block of. Part of `externalize_all`."""
+    cur.executemany(
+        "UPDATE blocks SET block_img=? WHERE rowid=?",
+        [update[:2] for update in updates],
+    )
+    cur.executemany(
+        "UPDATE stories SET last_block_img=? WHERE story_id=? AND last_block_id=?",
+        [(update[0],) + update[2:] for update in updates],
+    )
+
+
+if __name__ == "__main__":
+    DB_FILE = sys.argv[1] if len(sys.argv) > 1 else "circlestories.db"
+    BLOB_DIR = sys.argv[2] if len(sys.argv) > 2 else "blobs"
+    blocks, size = externalize_all(StoryDB(DB_FILE), BlobStore(BLOB_DIR))
+    print(f"{DB_FILE}: moved {blocks} images ({size} bytes) to {BLOB_DIR}")
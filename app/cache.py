@@ -0,0 +1,113 @@
+# CircleTable — Christopher Liu, Yusuf Elsharawy, Deven Maheshwari, Naomi Naranjo
+# SoftDev
+# P00: CircleStories
+
+"""Caches
+
+In-process caches used to avoid re-querying and re-rendering data that
+hasn't changed.
+"""
+
+from collections import OrderedDict
+import threading
+
+
+class LRUCache:
+    """A thread-safe dictionary that evicts its least recently used entries
+    once the total size of its values goes over `max_size`. The size of a
+    value is measured with `sizeof`."""
+
+    def __init__(self, max_size, sizeof=len):
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Returns the value for `key` (marking it as recently used), or
+        `default` if it isn't cached."""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def set(self, key, value):
+        """Caches `value` under `key`, evicting old entries if necessary.
+        Values bigger than the whole cache aren't stored."""
+        size = self.sizeof(value)
+        with self._lock:
+            self._remove(key)
+            if size > self.max_size:
+                return
+            self._entries[key] = value
+            self.size += size
+            while self.size > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def pop(self, key):
+        """Removes `key` from the cache if it is there."""
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        """Removes every entry from the cache."""
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def _remove(self, key):
+        if key in self._entries:
+            self.size -= self.sizeof(self._entries.pop(key))
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class FragmentCache:
+    """Caches rendered HTML, such as each user's homepage, along with the
+    version of the data it was rendered from (e.g. StoryDB.listing_version).
+    Entries are only used while that version is current."""
+
+    def __init__(self, max_size):
+        # Entries are (version, html); only the html counts towards the size
+        self.entries = LRUCache(max_size, sizeof=lambda entry: len(entry[1]))
+
+    def get(self, key, version):
+        """Returns the HTML cached under `key` at `version`, or None."""
+        entry = self.entries.get(key)
+        if entry is None or entry[0] != version:
+            return None
+        return entry[1]
+
+    def set(self, key, version, html):
+        """Caches HTML rendered at `version` under `key`."""
+        self.entries.set(key, (version, html))
+
+
+class StoryRenderCache(FragmentCache):
+    """Caches the rendered HTML of each story's blocks, keyed by story_id at
+    the story's version (see StoryDB.Story.version).
+
+    `render_block(author_id, block_text, block_img)` renders a single block;
+    it is used to extend cached stories when a block is added."""
+
+    def __init__(self, render_block, max_size):
+        super().__init__(max_size)
+        self.render_block = render_block
+
+    def append_block(self, story_id, old_version, new_version, block):
+        """Extends the cached HTML of a story that just got a new block
+        (a tuple of author_id, block_text, block_img), going from
+        `old_version` to `new_version`. If the cached entry isn't at
+        `old_version` it is dropped instead."""
+        html = self.get(story_id, old_version)
+        if html is None:
+            self.entries.pop(story_id)
+            return
+        self.set(story_id, new_version, html + self.render_block(*block))
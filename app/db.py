@@ -0,0 +1,418 @@
+# CircleTable — Christopher Liu, Yusuf Elsharawy, Deven Maheshwari, Naomi Naranjo
+# SoftDev
+# P00: CircleStories
+
+"""Database Connections
+
+Provides the connection pool shared by StoryDB and auth, so that requests
+reuse a few long-lived SQLite connections instead of opening a new one for
+every query.
+
+Reads can also be sent to pools of their own: read-only connections to the
+same file, which see every committed write but can never take the write lock,
+or a snapshot, a private copy of the database made with the backup API and
+refreshed every few seconds, for reads that don't mind being a little stale.
+"""
+
+import atexit
+from contextlib import closing, contextmanager
+import logging
+import os
+import queue
+import sqlite3
+import tempfile
+import threading
+from urllib.request import pathname2url
+
+# Run once on every new connection.
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-8000",
+)
+
+# Run once on every new read-only connection.
+READ_ONLY_PRAGMAS = (
+    "PRAGMA query_only=ON",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-8000",
+)
+
+# Number of prepared statements each connection keeps around for reuse.
+# Connections are passed between threads (never used by two at once), so
+# they are opened with check_same_thread=False.
+STATEMENT_CACHE_SIZE = 256
+
+# Idle connections each pool keeps for reuse; more are closed when returned
+POOL_SIZE = 16
+
+# Seconds a snapshot is used for before it is copied again
+SNAPSHOT_MAX_AGE = 5.0
+
+LOGGER = logging.getLogger(__name__)
+
+# Pools by database file, shared by everything that uses the same file.
+POOLS = {}
+# Read-only and snapshot pools by (database file, kind)
+READ_POOLS = {}
+POOLS_LOCK = threading.Lock()
+
+
+def file_uri(path):
+    """Returns the SQLite URI of a file, without any parameters."""
+    return "file:" + pathname2url(os.path.abspath(path))
+
+
+class ConnectionPool:  # pylint: disable=too-many-instance-attributes
+    """Lends out long-lived connections to a database file. `connect()`
+    checks a connection out of a stack of idle ones (opening a new one if
+    there are none) and checks it back in afterwards, so connections are
+    reused across threads, including the short-lived ones that threaded
+    servers start for every request. Up to POOL_SIZE idle connections are
+    kept; a thread that calls `connect()` again while it holds a connection
+    gets the same one. With `pooled=False` a new connection is opened (and
+    closed) for every `connect()`, which is how the app used to behave. With
+    `read_only=True` the connections can only read."""
+
+    def __init__(self, db_file, pooled=True, read_only=False):
+        self.db_file = db_file
+        self.pooled = pooled
+        self.read_only = read_only
+        # Class of the cursors handed out by connect(); see app.metrics
+        self.cursor_factory = sqlite3.Cursor
+        self.connections_opened = 0
+        # What each thread has checked out
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # Idle (target, connection) pairs, and the process they belong to
+        self._idle = None
+        self._idle_pid = None
+
+    def open(self):
+        """Opens and configures a brand new connection."""
+        if self.read_only:
+            return self.configure(
+                sqlite3.connect(
+                    file_uri(self.db_file) + "?mode=ro",
+                    uri=True,
+                    cached_statements=STATEMENT_CACHE_SIZE,
+                    check_same_thread=False,
+                ),
+                READ_ONLY_PRAGMAS,
+            )
+        return self.configure(
+            sqlite3.connect(
+                self.db_file,
+                cached_statements=STATEMENT_CACHE_SIZE,
+                check_same_thread=False,
+            ),
+            PRAGMAS,
+        )
+
+    def configure(self, con, pragmas):
+        """Runs `pragmas` on a connection that was just opened, counts it and
+        returns it."""
+        for pragma in pragmas:
+            con.execute(pragma)
+        with self._lock:
+            self.connections_opened += 1
+        return con
+
+    def target(self):
+        """Returns the file new connections should be opened to. Idle
+        connections to an earlier target are closed rather than reused. A
+        plain pool only has its own file; see SnapshotPool."""
+        return self.db_file
+
+    def open_target(self, target):  # pylint: disable=unused-argument
+        """Opens a connection to `target` (see `target`)."""
+        return self.open()
+
+    def idle(self):
+        """Returns this process's stack of idle (target, connection) pairs.
+        Connections inherited from a parent process by fork() are never
+        used, since sharing them between processes corrupts their state."""
+        if self._idle_pid != os.getpid():
+            with self._lock:
+                if self._idle_pid != os.getpid():
+                    self._idle = queue.LifoQueue(POOL_SIZE)
+                    self._idle_pid = os.getpid()
+        return self._idle
+
+    def checkout(self):
+        """Returns (target, connection) for an idle connection to the current
+        target, opening one if there is none."""
+        target = self.target()
+        idle = self.idle()
+        while True:
+            try:
+                con_target, con = idle.get_nowait()
+            except queue.Empty:
+                return target, self.open_target(target)
+            if con_target == target:
+                return target, con
+            con.close()
+
+    def checkin(self, target, con):
+        """Puts a checked out connection back with the idle ones, or closes
+        it if there are enough of those or its target is out of date."""
+        if target == self.target():
+            try:
+                self.idle().put_nowait((target, con))
+                return
+            except queue.Full:
+                pass
+        con.close()
+
+    def hold(self):
+        """Returns the state of what this thread has checked out, resetting
+        it in a process forked from the one that set it."""
+        local = self._local
+        if getattr(local, "pid", None) != os.getpid():
+            local.pid = os.getpid()
+            local.depth = 0
+            local.target = local.con = None
+        if local.depth == 0:
+            local.target, local.con = self.checkout()
+        local.depth += 1
+        return local
+
+    def get(self):
+        """Returns the connection this thread has checked out, checking one
+        out for the rest of the thread's life if it has none. For tools that
+        need the connection a thread's statements run on (e.g. to trace
+        them); the app itself uses `connect`."""
+        return self.hold().con
+
+    def close_idle(self):
+        """Closes this process's idle connections."""
+        idle = self.idle()
+        while True:
+            try:
+                _, con = idle.get_nowait()
+            except queue.Empty:
+                return
+            con.close()
+
+    @contextmanager
+    def connect(self):
+        """Context manager for a connection & cursor simultaneously. The
+        transaction is committed on success and rolled back on error."""
+        if not self.pooled:
+            con = self.open()
+            try:
+                with con:
+                    yield con.cursor(self.cursor_factory)
+            finally:
+                con.close()
+            return
+
+        local = self.hold()
+        con = local.con
+        try:
+            with con:
+                yield con.cursor(self.cursor_factory)
+        finally:
+            local.depth -= 1
+            if local.depth == 0:
+                local.con = None
+                self.checkin(local.target, con)
+
+
+class SnapshotPool(ConnectionPool):  # pylint: disable=too-many-instance-attributes
+    """Hands out read-only connections to a snapshot of a database file: a
+    copy made with the backup API, which is replaced by a fresh copy every
+    `max_age` seconds. Reads from a snapshot never wait for (or hold up)
+    writers or checkpoints of the real database, but may be up to `max_age`
+    seconds (plus the time a copy takes) out of date.
+
+    Each process makes its own snapshots, in the temporary directory, on a
+    background thread started by its first connection, so no request ever
+    waits for a copy, and no copy is made if nothing was committed since the
+    last one. Until the process's first snapshot is ready, connections go to
+    the live file (read-only) instead. After each copy, idle connections to
+    older snapshots are closed, so a process keeps up to three copies of the
+    database on disk (the current one, the previous one and the one being
+    made), plus any that requests still reading them hold open."""
+
+    def __init__(self, db_file, max_age=SNAPSHOT_MAX_AGE):
+        super().__init__(db_file, read_only=True)
+        self.max_age = max_age
+        self.snapshot_file = None
+        self.refreshes = 0
+        # Process that made snapshot_file, the files it made before it, and
+        # the data_version of the database when it was copied
+        self._owner = None
+        self._old_files = []
+        self._copied_version = None
+        # Process whose background thread makes the snapshots
+        self._refresher = None
+        self._refresher_lock = threading.Lock()
+        self._stopped = threading.Event()
+        atexit.register(self.remove_snapshots)
+
+    def open_target(self, target):
+        """Opens a connection to a snapshot, or to the live file if `target`
+        is the database file. A snapshot never changes once made, so SQLite
+        can skip locking it altogether."""
+        if target == self.db_file:
+            return self.open()
+        return self.configure(
+            sqlite3.connect(
+                file_uri(target) + "?mode=ro&immutable=1",
+                uri=True,
+                cached_statements=STATEMENT_CACHE_SIZE,
+                check_same_thread=False,
+            ),
+            READ_ONLY_PRAGMAS,
+        )
+
+    def refresh(self, source):
+        """Copies the database into a new snapshot file through `source`, a
+        read-only connection to it, unless nothing was committed since the
+        last copy through it. Returns whether a copy was made. Connections
+        switch to the new snapshot the next time they are checked out."""
+        # Changes whenever another connection commits to the database
+        version = source.execute("PRAGMA data_version").fetchone()[0]
+        if self._owner == os.getpid() and version == self._copied_version:
+            return False
+
+        handle, snapshot_file = tempfile.mkstemp(
+            prefix="circlestories-snapshot-", suffix=".db"
+        )
+        os.close(handle)
+        with closing(sqlite3.connect(snapshot_file)) as snapshot:
+            source.backup(snapshot)
+            # The copy doesn't need a WAL, which immutable files can't have
+            snapshot.execute("PRAGMA journal_mode=DELETE")
+        if self._stopped.is_set():
+            # remove_snapshots has already run, and won't see this file
+            self.remove(snapshot_file)
+            return False
+
+        if self._owner == os.getpid():
+            self._old_files.append(self.snapshot_file)
+        else:
+            # Inherited by fork(); the parent process removes its own files
+            self._old_files = []
+        self.snapshot_file = snapshot_file
+        self._copied_version = version
+        self._owner = os.getpid()
+        self.refreshes += 1
+        self.close_outdated()
+        # Requests may still be reading the previous snapshot, but older ones
+        # were replaced at least `max_age` seconds ago
+        while len(self._old_files) > 1:
+            self.remove(self._old_files.pop(0))
+        return True
+
+    def close_outdated(self):
+        """Closes the idle connections to snapshots other than the latest,
+        so that they don't keep replaced files around. Connections that are
+        checked out are closed when they are returned."""
+        target = self.target()
+        idle = self.idle()
+        current = []
+        while True:
+            try:
+                con_target, con = idle.get_nowait()
+            except queue.Empty:
+                break
+            if con_target == target:
+                current.append((con_target, con))
+            else:
+                con.close()
+        for con_target, con in reversed(current):
+            self.checkin(con_target, con)
+
+    def run_refresher(self):
+        """Makes a new snapshot every `max_age` seconds (if anything changed)
+        until the process exits. Runs on the background thread started by
+        `target`."""
+        source = None
+        while not self._stopped.is_set():
+            try:
+                if source is None:
+                    source = sqlite3.connect(
+                        file_uri(self.db_file) + "?mode=ro", uri=True
+                    )
+                self.refresh(source)
+            except (sqlite3.Error, OSError):
+                LOGGER.exception("Couldn't snapshot %s", self.db_file)
+                if source is not None:
+                    source.close()
+                    source = None
+            self._stopped.wait(self.max_age)
+        if source is not None:
+            source.close()
+
+    def target(self):
+        """Returns the latest snapshot, or the live file if this process has
+        none yet, starting the background refresher first if
+        this process doesn't have one."""
+        if self._refresher != os.getpid():
+            with self._refresher_lock:
+                if self._refresher != os.getpid():
+                    # Threads don't survive fork(), so each process starts one
+                    threading.Thread(
+                        target=self.run_refresher,
+                        name="snapshot-refresher",
+                        daemon=True,
+                    ).start()
+                    self._refresher = os.getpid()
+        return self.snapshot_file if self._owner == os.getpid() else self.db_file
+
+    def remove_snapshots(self):
+        """Stops the refresher and removes the snapshot files made by this
+        process."""
+        self._stopped.set()
+        if self._owner == os.getpid():
+            for snapshot_file in self._old_files + [self.snapshot_file]:
+                self.remove(snapshot_file)
+            self._old_files = []
+
+    @staticmethod
+    def remove(snapshot_file):
+        """Removes a snapshot file. Connections that still have it open can
+        keep reading it where the OS allows that."""
+        try:
+            os.remove(snapshot_file)
+        except OSError:
+            pass
+
+
+def get_pool(db_file):
+    """Returns the shared pool for the given database file."""
+    with POOLS_LOCK:
+        if db_file not in POOLS:
+            POOLS[db_file] = ConnectionPool(db_file)
+        return POOLS[db_file]
+
+
+def get_read_pool(db_file):
+    """Returns the shared pool of read-only connections to the given
+    database file."""
+    with POOLS_LOCK:
+        if (db_file, "read_only") not in READ_POOLS:
+            READ_POOLS[db_file, "read_only"] = ConnectionPool(db_file, read_only=True)
+        return READ_POOLS[db_file, "read_only"]
+
+
+def get_snapshot_pool(db_file, max_age=None):
+    """Returns the shared snapshot pool for the given database file. If
+    `max_age` is given, it is set to refresh its snapshot that often."""
+    with POOLS_LOCK:
+        if (db_file, "snapshot") not in READ_POOLS:
+            READ_POOLS[db_file, "snapshot"] = SnapshotPool(db_file)
+        pool = READ_POOLS[db_file, "snapshot"]
+    if max_age is not None:
+        pool.max_age = max_age
+    return pool
+
+
+def all_pools(db_file):
+    """Returns the shared pools of every kind for the given database file."""
+    return (get_pool(db_file), get_read_pool(db_file), get_snapshot_pool(db_file))
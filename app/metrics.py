@@ -0,0 +1,240 @@
+# CircleTable — Christopher Liu, Yusuf Elsharawy, Deven Maheshwari, Naomi Naranjo
+# SoftDev
+# P00: CircleStories
+
+"""Query Instrumentation
+
+Optional instrumentation of every database query made through the connection
+pool, by StoryDB and auth alike. When the INSTRUMENT_QUERIES setting is on,
+each request counts its queries, the time spent in them and the connections
+it checked out, and:
+
+- totals per endpoint are served at /metrics in the Prometheus text format,
+- queries slower than SLOW_QUERY_MS are logged as warnings,
+- with QUERY_HEADERS on, responses carry X-Query-Count, X-Query-Time (in ms)
+  and X-DB-Checkouts headers. For streamed pages these only cover the work
+  done before the first byte was sent; /metrics covers all of it.
+
+Every worker process keeps its own totals.
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+
+from flask import Blueprint, Response, current_app, g, request
+
+from app import auth
+from app.db import POOLS, POOLS_LOCK, READ_POOLS
+
+LOGGER = logging.getLogger(__name__)
+
+# Queries slower than this are logged, outside of requests. Requests use
+# their app's SLOW_QUERY_MS setting.
+SLOW_QUERY_SECONDS = 0.1
+
+# Registered by create_app when INSTRUMENT_QUERIES is on
+bp = Blueprint("metrics", __name__)
+
+
+class QueryStats:
+    """Query counts and timings, for one request or for the whole process."""
+
+    __slots__ = ("queries", "query_seconds", "checkouts", "slow_queries")
+
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.checkouts = 0
+        self.slow_queries = 0
+
+    def add(self, checkouts=0, queries=0, seconds=0.0, slow_queries=0):
+        """Adds to the counts."""
+        self.checkouts += checkouts
+        self.queries += queries
+        self.query_seconds += seconds
+        self.slow_queries += slow_queries
+
+    def as_dict(self):
+        """Returns the counts by field name."""
+        return {name: getattr(self, name) for name in QueryStats.__slots__}
+
+
+# Stats of the request being handled by each thread
+CURRENT = threading.local()
+
+# Totals over every query, in or out of a request
+TOTALS = QueryStats()
+
+# endpoint -> {"requests": ..., "seconds": ..., plus the QueryStats fields}
+ENDPOINTS = {}
+STATS_LOCK = threading.Lock()
+
+
+def record(checkouts=0, queries=0, seconds=0.0, statement=None):
+    """Adds work done by this thread to its request and to the totals."""
+    slow = statement is not None and seconds >= getattr(
+        CURRENT, "slow_query_seconds", SLOW_QUERY_SECONDS
+    )
+    if slow:
+        LOGGER.warning(
+            "Slow query (%.1f ms): %s", seconds * 1000, " ".join(statement.split())
+        )
+
+    request_stats = getattr(CURRENT, "stats", None)
+    if request_stats is not None:
+        request_stats.add(checkouts, queries, seconds, slow)
+    with STATS_LOCK:
+        TOTALS.add(checkouts, queries, seconds, slow)
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """A cursor that records its queries and the time spent running them and
+    fetching their results."""
+
+    def __init__(self, con):
+        super().__init__(con)
+        record(checkouts=1)
+
+    def execute(self, sql, parameters=()):
+        """Like sqlite3.Cursor.execute, but recorded."""
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            record(queries=1, seconds=time.perf_counter() - start, statement=sql)
+
+    def executemany(self, sql, seq_of_parameters):
+        """Like sqlite3.Cursor.executemany, but recorded."""
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            record(queries=1, seconds=time.perf_counter() - start, statement=sql)
+
+    def fetchone(self):
+        """Like sqlite3.Cursor.fetchone, but recorded."""
+        start = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            record(seconds=time.perf_counter() - start)
+
+    def fetchmany(self, size=None):
+        """Like sqlite3.Cursor.fetchmany, but recorded."""
+        start = time.perf_counter()
+        try:
+            return super().fetchmany(self.arraysize if size is None else size)
+        finally:
+            record(seconds=time.perf_counter() - start)
+
+    def fetchall(self):
+        """Like sqlite3.Cursor.fetchall, but recorded."""
+        start = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            record(seconds=time.perf_counter() - start)
+
+
+@bp.before_app_request
+def start_request():
+    """Starts counting this request's queries."""
+    CURRENT.stats = QueryStats()
+    CURRENT.slow_query_seconds = current_app.config["SLOW_QUERY_MS"] / 1000
+    g.request_start = time.perf_counter()
+
+
+@bp.after_app_request
+def add_headers(response):
+    """Reports the queries made so far in the response headers, if the
+    QUERY_HEADERS setting is on."""
+    stats = getattr(CURRENT, "stats", None)
+    if stats is not None and current_app.config["QUERY_HEADERS"]:
+        response.headers["X-Query-Count"] = str(stats.queries)
+        response.headers["X-Query-Time"] = f"{stats.query_seconds * 1000:.3f}"
+        response.headers["X-DB-Checkouts"] = str(stats.checkouts)
+    return response
+
+
+@bp.teardown_app_request
+def finish_request(_error):
+    """Adds this request's queries to its endpoint's totals. Streamed
+    responses are torn down once the last chunk is sent, so they count in
+    full."""
+    stats = getattr(CURRENT, "stats", None)
+    if stats is None:
+        return
+    CURRENT.stats = None
+    del CURRENT.slow_query_seconds
+    elapsed = time.perf_counter() - g.get("request_start", time.perf_counter())
+
+    with STATS_LOCK:
+        totals = ENDPOINTS.setdefault(
+            str(request.endpoint),
+            dict.fromkeys(("requests", "seconds") + QueryStats.__slots__, 0),
+        )
+        totals["requests"] += 1
+        totals["seconds"] += elapsed
+        for name, value in stats.as_dict().items():
+            totals[name] += value
+
+
+def format_metric(lines, name, description, samples):
+    """Appends a counter and its (labels, value) samples to `lines`."""
+    lines.append(f"# HELP {name} {description}")
+    lines.append(f"# TYPE {name} counter")
+    for labels, value in samples:
+        label_text = ",".join(f'{key}="{value}"' for key, value in labels.items())
+        lines.append(f"{name}{{{label_text}}} {value}" if labels else f"{name} {value}")
+
+
+@bp.route("/metrics")
+def metrics():
+    """Serves the totals in the Prometheus text exposition format."""
+    with STATS_LOCK:
+        endpoints = {endpoint: dict(totals) for endpoint, totals in ENDPOINTS.items()}
+        totals = TOTALS.as_dict()
+    with POOLS_LOCK:
+        connections = sum(
+            pool.connections_opened
+            for pool in list(POOLS.values()) + list(READ_POOLS.values())
+        )
+    users = auth.user_cache_stats()
+
+    lines = []
+    for name, key, description in (
+        ("requests_total", "requests", "Requests handled"),
+        ("request_seconds_total", "seconds", "Time spent handling requests"),
+        ("request_queries_total", "queries", "Queries run by requests"),
+        (
+            "request_query_seconds_total",
+            "query_seconds",
+            "Time requests spent running queries and fetching rows",
+        ),
+        (
+            "request_db_checkouts_total",
+            "checkouts",
+            "Database cursors checked out by requests",
+        ),
+        ("request_slow_queries_total", "slow_queries", "Slow queries run by requests"),
+    ):
+        format_metric(
+            lines,
+            f"circlestories_{name}",
+            f"{description}, by endpoint.",
+            [({"endpoint": e}, endpoints[e][key]) for e in sorted(endpoints)],
+        )
+    for name, value, description in (
+        ("queries_total", totals["queries"], "Queries run, in or out of requests"),
+        ("query_seconds_total", totals["query_seconds"], "Time spent in queries"),
+        ("db_checkouts_total", totals["checkouts"], "Database cursors checked out"),
+        ("slow_queries_total", totals["slow_queries"], "Slow queries run"),
+        ("db_connections_opened_total", connections, "Database connections opened"),
+        ("user_cache_hits_total", users["hits"], "User cache hits"),
+        ("user_cache_misses_total", users["misses"], "User cache misses"),
+    ):
+        format_metric(lines, f"circlestories_{name}", f"{description}.", [({}, value)])
+
+    return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,343 @@
+# CircleTable — Christopher Liu, Yusuf Elsharawy, Deven Maheshwari, Naomi Naranjo
+# SoftDev
+# P00: CircleStories
+
+"""Schema Migrations
+
+Keeps the database schema up to date. The schema version is stored in
+SQLite's `user_version` pragma, and every migration that hasn't been applied
+yet is run in order, so existing database files are upgraded in place.
+
+Run `python3 -m app.migrations [db_file]` to upgrade a database by hand.
+"""
+
+import sys
+
+from app.db import get_pool
+
+# Migration N (counting from 1) upgrades a database from version N-1 to N.
+# Never edit a migration that has shipped; add a new one instead.
+MIGRATIONS = [
+    # 1: Original tables. These may already exist in databases created
+    # before migrations were introduced.
+    (
+        """CREATE TABLE IF NOT EXISTS stories (
+            story_id            TEXT PRIMARY KEY DEFAULT (hex(randomblob(8))),
+            creation_timestamp  DATE DEFAULT CURRENT_TIMESTAMP,
+            creator_id          INTEGER,
+            num_blocks          INTEGER DEFAULT 0,
+            last_block_id       INTEGER,
+            title               TEXT
+        )""",
+        """CREATE TABLE IF NOT EXISTS blocks (
+            block_id            TEXT PRIMARY KEY DEFAULT (hex(randomblob(8))),
+            creation_timestamp  DATE DEFAULT CURRENT_TIMESTAMP,
+            story_id            INTEGER,
+            author_id           INTEGER,
+            position            INTEGER,
+            block_text          TEXT,
+            block_img           TEXT
+        )""",
+        """CREATE TABLE IF NOT EXISTS users (
+            user_id             TEXT PRIMARY KEY DEFAULT (hex(randomblob(8))),
+            username            TEXT,
+            password            TEXT
+        )""",
+    ),
+    # 2: Indexes for the hot queries.
+    (
+        # Reading a story in order, its contributors and its last block
+        """CREATE INDEX IF NOT EXISTS blocks_story_position
+        ON blocks(story_id, position, author_id)""",
+        # Contribution checks and listings
+        """CREATE INDEX IF NOT EXISTS blocks_author_story
+        ON blocks(author_id, story_id)""",
+        # Logins and user id lookups
+        """CREATE UNIQUE INDEX IF NOT EXISTS users_username
+        ON users(username)""",
+    ),
+    # 3: Keyset pagination of story listings
+    (
+        """CREATE INDEX IF NOT EXISTS stories_creation
+        ON stories(creation_timestamp, story_id)""",
+    ),
+    # 4: Full-text search over story titles and block text. The indexes only
+    # store terms (the text stays in the tables) and triggers keep them in
+    # sync, so every writer updates them without knowing they exist.
+    (
+        """CREATE VIRTUAL TABLE IF NOT EXISTS stories_fts USING fts5(
+            title, content='stories', content_rowid='rowid',
+            tokenize='porter unicode61'
+        )""",
+        """CREATE VIRTUAL TABLE IF NOT EXISTS blocks_fts USING fts5(
+            block_text, content='blocks', content_rowid='rowid',
+            tokenize='porter unicode61'
+        )""",
+        """CREATE TRIGGER IF NOT EXISTS stories_fts_insert AFTER INSERT ON stories
+        BEGIN
+            INSERT INTO stories_fts(rowid, title) VALUES (new.rowid, new.title);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS stories_fts_delete AFTER DELETE ON stories
+        BEGIN
+            INSERT INTO stories_fts(stories_fts, rowid, title)
+            VALUES ('delete', old.rowid, old.title);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS stories_fts_update
+        AFTER UPDATE OF title ON stories
+        BEGIN
+            INSERT INTO stories_fts(stories_fts, rowid, title)
+            VALUES ('delete', old.rowid, old.title);
+            INSERT INTO stories_fts(rowid, title) VALUES (new.rowid, new.title);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS blocks_fts_insert AFTER INSERT ON blocks
+        BEGIN
+            INSERT INTO blocks_fts(rowid, block_text)
+            VALUES (new.rowid, new.block_text);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS blocks_fts_delete AFTER DELETE ON blocks
+        BEGIN
+            INSERT INTO blocks_fts(blocks_fts, rowid, block_text)
+            VALUES ('delete', old.rowid, old.block_text);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS blocks_fts_update
+        AFTER UPDATE OF block_text ON blocks
+        BEGIN
+            INSERT INTO blocks_fts(blocks_fts, rowid, block_text)
+            VALUES ('delete', old.rowid, old.block_text);
+            INSERT INTO blocks_fts(rowid, block_text)
+            VALUES (new.rowid, new.block_text);
+        END""",
+        # Index everything written before this migration
+        "INSERT INTO stories_fts(stories_fts) VALUES ('rebuild')",
+        "INSERT INTO blocks_fts(blocks_fts) VALUES ('rebuild')",
+    ),
+    # 5: Who has contributed to which story, one row per pair, for access
+    # checks and the homepage listings. Triggers keep it in sync with blocks.
+    (
+        """CREATE TABLE IF NOT EXISTS story_contributors (
+            user_id             TEXT,
+            story_id            TEXT,
+            PRIMARY KEY (user_id, story_id)
+        ) WITHOUT ROWID""",
+        """CREATE TRIGGER IF NOT EXISTS story_contributors_insert
+        AFTER INSERT ON blocks
+        BEGIN
+            INSERT OR IGNORE INTO story_contributors(user_id, story_id)
+            VALUES (CAST(new.author_id AS TEXT), CAST(new.story_id AS TEXT));
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS story_contributors_delete
+        AFTER DELETE ON blocks
+        WHEN NOT EXISTS (
+            SELECT TRUE FROM blocks
+            WHERE author_id = old.author_id AND story_id = old.story_id
+        )
+        BEGIN
+            DELETE FROM story_contributors
+            WHERE user_id = CAST(old.author_id AS TEXT)
+            AND story_id = CAST(old.story_id AS TEXT);
+        END""",
+        """INSERT OR IGNORE INTO story_contributors(user_id, story_id)
+        SELECT CAST(author_id AS TEXT), CAST(story_id AS TEXT) FROM blocks
+        WHERE author_id IS NOT NULL""",
+    ),
+    # 6: A copy of each story's last block on its row, for the append page
+    (
+        "ALTER TABLE stories ADD COLUMN last_block_text TEXT",
+        "ALTER TABLE stories ADD COLUMN last_block_img TEXT",
+        "ALTER TABLE stories ADD COLUMN last_block_timestamp DATE",
+        """UPDATE stories
+        SET (last_block_text, last_block_img, last_block_timestamp) = (
+            SELECT block_text, block_img, creation_timestamp FROM blocks
+            WHERE blocks.block_id = CAST(stories.last_block_id AS TEXT)
+        )
+        WHERE last_block_id IS NOT NULL""",
+    ),
+    # 7: Counters that let cached listings tell whether they are current:
+    # story_version goes up whenever a story gets its first block (and so
+    # starts being listed), and contributions:<user_id> whenever that user
+    # joins a story
+    (
+        """CREATE TABLE IF NOT EXISTS meta (
+            name                TEXT PRIMARY KEY,
+            value               INTEGER
+        )""",
+        "INSERT OR IGNORE INTO meta(name, value) VALUES ('story_version', 0)",
+        """CREATE TRIGGER IF NOT EXISTS story_version_insert
+        AFTER INSERT ON blocks
+        WHEN new.position = 0
+        BEGIN
+            UPDATE meta SET value = value + 1 WHERE name = 'story_version';
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS contributions_version_insert
+        AFTER INSERT ON story_contributors
+        BEGIN
+            INSERT INTO meta(name, value) VALUES ('contributions:' || new.user_id, 1)
+            ON CONFLICT(name) DO UPDATE SET value = value + 1;
+        END""",
+    ),
+    # 8: TEXT affinity for the id columns of blocks and stories. With INTEGER
+    # affinity, ids that look like numbers were stored as numbers ('0123...'
+    # as 123..., '91E2389969800374' as inf), so they didn't match the TEXT
+    # ids they refer to. SQLite can't change a column's type, so both tables
+    # are rebuilt, keeping their rowids (which the full-text indexes use).
+    # Numeric ids are recovered by finding the one row they could have come
+    # from, and kept as text if there isn't exactly one.
+    (
+        """CREATE TABLE blocks_new (
+            block_id            TEXT PRIMARY KEY DEFAULT (hex(randomblob(8))),
+            creation_timestamp  DATE DEFAULT CURRENT_TIMESTAMP,
+            story_id            TEXT,
+            author_id           TEXT,
+            position            INTEGER,
+            block_text          TEXT,
+            block_img           TEXT
+        )""",
+        """INSERT INTO blocks_new(
+            rowid, block_id, creation_timestamp, story_id, author_id, position,
+            block_text, block_img
+        )
+        SELECT
+            rowid, block_id, creation_timestamp,
+            CASE WHEN story_id IS NULL OR typeof(story_id) = 'text' THEN story_id
+            ELSE coalesce((
+                SELECT CASE WHEN count(*) = 1 THEN max(stories.story_id) END
+                FROM stories WHERE stories.story_id = blocks.story_id
+            ), CAST(story_id AS TEXT)) END,
+            CASE WHEN author_id IS NULL OR typeof(author_id) = 'text' THEN author_id
+            ELSE coalesce((
+                SELECT CASE WHEN count(*) = 1 THEN max(users.user_id) END
+                FROM users WHERE users.user_id = blocks.author_id
+            ), CAST(author_id AS TEXT)) END,
+            position, block_text, block_img
+        FROM blocks""",
+        "DROP TABLE blocks",
+        "ALTER TABLE blocks_new RENAME TO blocks",
+        """CREATE INDEX blocks_story_position
+        ON blocks(story_id, position, author_id)""",
+        "CREATE INDEX blocks_author_story ON blocks(author_id, story_id)",
+        """CREATE TABLE stories_new (
+            story_id            TEXT PRIMARY KEY DEFAULT (hex(randomblob(8))),
+            creation_timestamp  DATE DEFAULT CURRENT_TIMESTAMP,
+            creator_id          TEXT,
+            num_blocks          INTEGER DEFAULT 0,
+            last_block_id       TEXT,
+            title               TEXT,
+            last_block_text     TEXT,
+            last_block_img      TEXT,
+            last_block_timestamp DATE
+        )""",
+        """INSERT INTO stories_new(
+            rowid, story_id, creation_timestamp, creator_id, num_blocks,
+            last_block_id, title, last_block_text, last_block_img,
+            last_block_timestamp
+        )
+        SELECT
+            rowid, story_id, creation_timestamp,
+            CASE WHEN creator_id IS NULL OR typeof(creator_id) = 'text'
+            THEN creator_id
+            ELSE coalesce((
+                SELECT CASE WHEN count(*) = 1 THEN max(users.user_id) END
+                FROM users WHERE users.user_id = stories.creator_id
+            ), CAST(creator_id AS TEXT)) END,
+            num_blocks,
+            CASE WHEN last_block_id IS NULL OR typeof(last_block_id) = 'text'
+            THEN last_block_id
+            ELSE coalesce((
+                SELECT block_id FROM blocks
+                WHERE blocks.story_id = stories.story_id
+                AND blocks.position = stories.num_blocks - 1
+            ), CAST(last_block_id AS TEXT)) END,
+            title, last_block_text, last_block_img, last_block_timestamp
+        FROM stories""",
+        "DROP TABLE stories",
+        "ALTER TABLE stories_new RENAME TO stories",
+        "CREATE INDEX stories_creation ON stories(creation_timestamp, story_id)",
+        # Dropping the tables dropped their triggers, so every trigger on them
+        # is created again, without the casts the old columns needed
+        """CREATE TRIGGER stories_fts_insert AFTER INSERT ON stories
+        BEGIN
+            INSERT INTO stories_fts(rowid, title) VALUES (new.rowid, new.title);
+        END""",
+        """CREATE TRIGGER stories_fts_delete AFTER DELETE ON stories
+        BEGIN
+            INSERT INTO stories_fts(stories_fts, rowid, title)
+            VALUES ('delete', old.rowid, old.title);
+        END""",
+        """CREATE TRIGGER stories_fts_update AFTER UPDATE OF title ON stories
+        BEGIN
+            INSERT INTO stories_fts(stories_fts, rowid, title)
+            VALUES ('delete', old.rowid, old.title);
+            INSERT INTO stories_fts(rowid, title) VALUES (new.rowid, new.title);
+        END""",
+        """CREATE TRIGGER blocks_fts_insert AFTER INSERT ON blocks
+        BEGIN
+            INSERT INTO blocks_fts(rowid, block_text)
+            VALUES (new.rowid, new.block_text);
+        END""",
+        """CREATE TRIGGER blocks_fts_delete AFTER DELETE ON blocks
+        BEGIN
+            INSERT INTO blocks_fts(blocks_fts, rowid, block_text)
+            VALUES ('delete', old.rowid, old.block_text);
+        END""",
+        """CREATE TRIGGER blocks_fts_update AFTER UPDATE OF block_text ON blocks
+        BEGIN
+            INSERT INTO blocks_fts(blocks_fts, rowid, block_text)
+            VALUES ('delete', old.rowid, old.block_text);
+            INSERT INTO blocks_fts(rowid, block_text)
+            VALUES (new.rowid, new.block_text);
+        END""",
+        """CREATE TRIGGER story_contributors_insert AFTER INSERT ON blocks
+        BEGIN
+            INSERT OR IGNORE INTO story_contributors(user_id, story_id)
+            VALUES (new.author_id, new.story_id);
+        END""",
+        """CREATE TRIGGER story_contributors_delete AFTER DELETE ON blocks
+        WHEN NOT EXISTS (
+            SELECT TRUE FROM blocks
+            WHERE author_id = old.author_id AND story_id = old.story_id
+        )
+        BEGIN
+            DELETE FROM story_contributors
+            WHERE user_id = old.author_id AND story_id = old.story_id;
+        END""",
+        """CREATE TRIGGER story_version_insert AFTER INSERT ON blocks
+        WHEN new.position = 0
+        BEGIN
+            UPDATE meta SET value = value + 1 WHERE name = 'story_version';
+        END""",
+        # Rows added through mangled ids pointed at the wrong (or no) story
+        "DELETE FROM story_contributors",
+        """INSERT OR IGNORE INTO story_contributors(user_id, story_id)
+        SELECT author_id, story_id FROM blocks WHERE author_id IS NOT NULL""",
+        # Cached listings may have been built from the wrong contributors
+        "UPDATE meta SET value = value + 1 WHERE name = 'story_version'",
+    ),
+]
+
+LATEST_VERSION = len(MIGRATIONS)
+
+
+def get_version(cur):
+    """Returns the schema version of the database."""
+    return cur.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(cur):
+    """Applies any pending migrations in a single transaction. Does nothing if
+    the database is already up to date. The write lock is taken before the
+    version is read, so concurrent callers can't apply a migration twice."""
+    cur.execute("BEGIN IMMEDIATE")
+    version = get_version(cur)
+    for statements in MIGRATIONS[version:]:
+        for statement in statements:
+            cur.execute(statement)
+    if version < LATEST_VERSION:
+        cur.execute(f"PRAGMA user_version={LATEST_VERSION}")
+
+
+if __name__ == "__main__":
+    DB_FILE = sys.argv[1] if len(sys.argv) > 1 else "circlestories.db"
+    with get_pool(DB_FILE).connect() as main_cur:
+        old_version = get_version(main_cur)
+        migrate(main_cur)
+    print(f"{DB_FILE}: schema version {old_version} -> {LATEST_VERSION}")
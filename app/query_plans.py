@@ -0,0 +1,123 @@
+# CircleTable — Christopher Liu, Yusuf Elsharawy, Deven Maheshwari, Naomi Naranjo
+# SoftDev
+# P00: CircleStories
+
+"""Query Plan Checks
+
+Runs the app's hot database paths against a scratch database, asks SQLite to
+EXPLAIN every SELECT they issue, and reports the ones that read a whole table
+instead of using an index. Also checks that ids that look like numbers
+(which SQLite may convert if a column has numeric affinity) still join up.
+
+Run `python3 -m app.query_plans`; it exits with an error if any query regressed
+to a full scan or any of those ids got lost.
+"""
+
+import os
+import sys
+import tempfile
+
+from app import auth
+from app.storydb import StoryDB
+
+# Tables that hot queries must never read in full.
+INDEXED_TABLES = ("blocks", "users", "story_contributors")
+
+# A user id with a leading zero and a story id that reads as a float (inf),
+# in the format of the generated ids
+NUMBER_LIKE_USER_ID = "0123456789012345"
+NUMBER_LIKE_STORY_ID = "91E2389969800374"
+
+
+def run_hot_paths(story_db):
+    """Exercises the queries behind login, the homepage and story pages."""
+    auth.create_user("planner", "password", "password")
+    # Make the lookups below hit the database
+    auth.clear_user_cache()
+    auth.authenticate_user("planner", "password")
+    user_id = auth.get_user_id("planner")
+    auth.get_username(user_id)
+
+    story_id = story_db.add_story(user_id, "Query Plans")
+    story_obj = story_db.get_story(story_id)
+    story_obj.add_block(user_id, "Once upon a time...", "")
+
+    story_db.is_contributor(user_id, story_id)
+    story_db.listing_version(user_id)
+    for contributed in (True, False):
+        _, cursor = story_db.list_stories(user_id, contributed, limit=1)
+        story_db.list_stories(user_id, contributed, after=cursor, limit=20)
+    story_obj.get_contributors()
+    story_obj.get_blocks()
+    list(story_obj.iter_blocks())
+    story_db.search("upon a time")
+
+
+def find_lost_ids(story_db):
+    """Creates a user and a story with number-like ids and returns a list of
+    the lookups that don't find them (empty if everything matches)."""
+    user_id, story_id = NUMBER_LIKE_USER_ID, NUMBER_LIKE_STORY_ID
+
+    def operation(cur):
+        cur.execute(
+            "INSERT INTO users(user_id, username, password) VALUES (?, ?, '')",
+            (user_id, "number-like"),
+        )
+        cur.execute(
+            "INSERT INTO stories(story_id, creator_id, title) VALUES (?, ?, ?)",
+            (story_id, user_id, "Number-like"),
+        )
+        StoryDB.append_block(cur, story_id, user_id, "Xylophones everywhere", "")
+
+    story_db.write(operation)
+    contributed, _ = story_db.list_stories(user_id, True, limit=20)
+    found = {
+        "is_contributor": story_db.is_contributor(user_id, story_id),
+        "contributed list": any(
+            row[:2] == (story_id, "number-like") for row in contributed
+        ),
+        "block search": any(
+            row[0] == story_id for row in story_db.search("xylophones")[0]
+        ),
+        "contributors": story_db.get_story(story_id).get_contributors() == [user_id],
+    }
+    return [lookup for lookup, ok in found.items() if not ok]
+
+
+def find_full_scans(db_file):
+    """Returns a list of (query, plan step) pairs for every query issued by
+    `run_hot_paths` that scans one of the INDEXED_TABLES."""
+    auth.DB_FILE = db_file
+    story_db = StoryDB(db_file)
+    con = story_db.pool.get()
+
+    statements = []
+    con.set_trace_callback(statements.append)
+    try:
+        run_hot_paths(story_db)
+    finally:
+        con.set_trace_callback(None)
+
+    scans = []
+    for statement in dict.fromkeys(statements):
+        if not statement.lstrip().upper().startswith("SELECT"):
+            continue
+        for *_, detail in con.execute("EXPLAIN QUERY PLAN " + statement):
+            words = detail.split()
+            if words[0] == "SCAN" and words[1] in INDEXED_TABLES:
+                scans.append((" ".join(statement.split()), detail))
+    return scans
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp:
+        full_scans = find_full_scans(os.path.join(tmp, "plans.db"))
+        lost_ids = find_lost_ids(StoryDB(os.path.join(tmp, "plans.db")))
+
+    for query, step in full_scans:
+        print(f"FULL SCAN ({step}): {query}")
+    for lookup in lost_ids:
+        print(f"LOST ID: {lookup} doesn't find a number-like id")
+    if full_scans or lost_ids:
+        sys.exit(1)
+    print("No full scans in hot queries, and number-like ids match")
@@ -7,58 +7,256 @@
 Handles all of the Flask app routes for CircleStories.
 """
 
-from flask import render_template, redirect, request, url_for, session
-
-from app import app
+from datetime import datetime, timezone
+import functools
+import hashlib
+import os
+import threading
+
+from flask import (
+    Blueprint,
+    abort,
+    Response,
+    current_app,
+    get_template_attribute,
+    render_template,
+    redirect,
+    request,
+    send_file,
+    stream_with_context,
+    url_for,
+    session,
+)
+from markupsafe import Markup
+
+from app.append_queue import AppendQueue
 from app.auth import authenticate_user, create_user, get_user_id, get_username
+from app.blobs import BLOB_PREFIX, BlobStore
+from app.cache import FragmentCache, StoryRenderCache
+from app.db import get_read_pool, get_snapshot_pool
 from app.storydb import StoryDB
 
-DB_FILE = "circlestories.db"
+bp = Blueprint("main", __name__)
+
+# Number of template chunks collected before each write of a streamed response
+STREAM_BUFFER = 32
+
+# How long browsers may keep images, which never change (a year, in seconds)
+IMAGE_MAX_AGE = 365 * 24 * 60 * 60
+
+# Guards the creation of each app's StoryDB
+STORY_DB_LOCK = threading.Lock()
+
+
+def get_story_db():
+    """Returns the current app's StoryDB, creating it (and setting up the
+    database) the first time it is needed rather than at import time."""
+    extensions = current_app.extensions
+    if "story_db" not in extensions:
+        with STORY_DB_LOCK:
+            if "story_db" not in extensions:
+                db_file = current_app.config["DB_FILE"]
+                story_db = StoryDB(db_file)
+                story_db.render_cache = StoryRenderCache(
+                    render_block, current_app.config["RENDER_CACHE_SIZE"]
+                )
+                if current_app.config["APPEND_QUEUE"]:
+                    story_db.append_queue = AppendQueue(story_db)
+                if current_app.config["READ_ONLY_CONNECTIONS"]:
+                    story_db.read_pool = get_read_pool(db_file)
+                if current_app.config["LISTING_SNAPSHOT_MAX_AGE"] is not None:
+                    story_db.listing_pool = get_snapshot_pool(
+                        db_file, current_app.config["LISTING_SNAPSHOT_MAX_AGE"]
+                    )
+                extensions["story_db"] = story_db
+    return extensions["story_db"]
+
+
+def get_blob_store():
+    """Returns the current app's BlobStore."""
+    extensions = current_app.extensions
+    if "blob_store" not in extensions:
+        extensions["blob_store"] = BlobStore(current_app.config["BLOB_DIR"])
+    return extensions["blob_store"]
+
+
+def get_homepage_cache():
+    """Returns the current app's cache of rendered homepages."""
+    extensions = current_app.extensions
+    if "homepage_cache" not in extensions:
+        extensions["homepage_cache"] = FragmentCache(
+            current_app.config["HOMEPAGE_CACHE_SIZE"]
+        )
+    return extensions["homepage_cache"]
+
+
+@bp.app_template_filter("image_url")
+def image_url(block_img):
+    """Returns the URL of a block's image, which may be stored as a blob."""
+    if block_img and block_img.startswith(BLOB_PREFIX):
+        return url_for("main.image", name=block_img[len(BLOB_PREFIX) :])
+    return block_img
+
+
+@bp.before_app_request
+def setup_database():
+    """Makes sure the database is set up before any request uses it (auth
+    relies on the tables StoryDB creates)."""
+    get_story_db()
+
+
+def render_block(author_id, block_text, block_img):
+    """Renders a single block of a story as HTML."""
+    story_block = get_template_attribute("story_block.html", "story_block")
+    return story_block(get_username(author_id), block_text, block_img)
+
+
+def render_story_blocks(story_db, story_obj):
+    """Yields the rendered blocks of a story one at a time, straight from the
+    database. The rendered story is cached at the end unless it outgrew the
+    cache, in which case it stops being kept in memory."""
+    story_block = get_template_attribute("story_block.html", "story_block")
+    max_size = story_db.render_cache.entries.max_size
+    fragments = []
+    size = 0
+    for username, block_text, block_img in story_obj.iter_blocks():
+        fragment = story_block(username, block_text, block_img)
+        if fragments is not None:
+            fragments.append(fragment)
+            size += len(fragment)
+            if size > max_size:
+                fragments = None
+        yield fragment
+    if fragments is not None:
+        story_db.render_cache.set(
+            story_obj.story_id, story_obj.version, Markup("").join(fragments)
+        )
+
 
-STORY_DB = StoryDB(DB_FILE)
+def stream_template(template_name, **context):
+    """Like render_template, but sends the page as it is rendered instead of
+    building it in memory first."""
+    app = current_app._get_current_object()  # pylint: disable=protected-access
+    app.update_template_context(context)
+    stream = app.jinja_env.get_template(template_name).stream(context)
+    stream.enable_buffering(STREAM_BUFFER)
+    return Response(stream_with_context(stream))
 
 
-def get_stories_info(story_ids):
-    """Takes a list of story id's and returns a list of tuples of:
-    (story_id, creator_username, story_title). This is useful
-    for Jinja to list out stories."""
-    result = []
-    for story_id in story_ids:
-        story_obj = STORY_DB.get_story(story_id)
-        result.append((story_id, get_username(story_obj.creator_id), story_obj.title))
-    return result
+@functools.lru_cache(maxsize=None)
+def templates_version():
+    """Returns a hash of the templates, so that pages cached by browsers are
+    invalidated when the templates change."""
+    templates = os.path.join(os.path.dirname(__file__), "templates")
+    digest = hashlib.sha1()
+    for name in sorted(os.listdir(templates)):
+        with open(os.path.join(templates, name), "rb") as file:
+            digest.update(file.read())
+    return digest.hexdigest()
 
 
-@app.route("/")
-@app.route("/index")
+def make_etag(*state):
+    """Returns an ETag for a page rendered from `state` (which should include
+    everything the page depends on, e.g. the user and story versions)."""
+    parts = (templates_version(),) + tuple(map(str, state))
+    return hashlib.sha1("|".join(parts).encode()).hexdigest()
+
+
+def parse_timestamp(timestamp):
+    """Converts an SQLite CURRENT_TIMESTAMP value to a UTC datetime."""
+    return datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S").replace(
+        tzinfo=timezone.utc
+    )
+
+
+def not_modified(etag, last_modified=None):
+    """Returns a 304 Not Modified response if the client's cached copy of the
+    page is current according to If-None-Match (or, without it,
+    If-Modified-Since), and None if the page has to be sent.
+    `last_modified` may be a function, only called if it is needed."""
+    if request.if_none_match:
+        fresh = request.if_none_match.contains(etag)
+    elif request.if_modified_since and last_modified is not None:
+        modified = last_modified() if callable(last_modified) else last_modified
+        fresh = modified is not None and modified <= request.if_modified_since
+    else:
+        fresh = False
+    return add_cache_headers(Response(status=304), etag) if fresh else None
+
+
+def add_cache_headers(response, etag, last_modified=None):
+    """Sets the validators of a response. Pages are private to their user and
+    must be revalidated before every use."""
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def current_user_id():
+    """Returns the id of the logged in user. It is kept in the session so that
+    it doesn't have to be looked up on every request."""
+    if "user_id" not in session:
+        # Sessions from before user ids were stored
+        session["user_id"] = get_user_id(session["username"])
+    return session["user_id"]
+
+
+@bp.route("/")
+@bp.route("/index")
 def index():
     """CircleStories homepage."""
     if "username" in session:
-        user_id = get_user_id(session["username"])
-
-        contributed_stories = get_stories_info(
-            STORY_DB.get_contributed_stories(user_id)
+        user_id = current_user_id()
+
+        # Each section is paginated separately with its own cursor
+        contributed_after = request.args.get("contributed_after")
+        not_contributed_after = request.args.get("not_contributed_after")
+        page_size = current_app.config["PAGE_SIZE"]
+
+        story_db = get_story_db()
+        version = story_db.listing_version(user_id)
+        etag = make_etag(user_id, page_size, *version)
+        response = not_modified(etag)
+        if response is not None:
+            return response
+
+        # The page only changes when a story is listed or the user joins one
+        key = (user_id, page_size, contributed_after, not_contributed_after)
+        page = get_homepage_cache().get(key, version)
+        if page is not None:
+            return add_cache_headers(Response(page), etag)
+
+        contributed_stories, contributed_next = story_db.list_stories(
+            user_id, contributed=True, after=contributed_after, limit=page_size
         )
-
-        not_contributed_stories = get_stories_info(
-            STORY_DB.get_not_contributed_stories(user_id)
+        not_contributed_stories, not_contributed_next = story_db.list_stories(
+            user_id, contributed=False, after=not_contributed_after, limit=page_size
         )
 
-        return render_template(
+        page = render_template(
             "homepage.html",
             username=session["username"],
             contributed_stories=contributed_stories,
             not_contributed_stories=not_contributed_stories,
+            contributed_after=contributed_after,
+            not_contributed_after=not_contributed_after,
+            contributed_next=contributed_next,
+            not_contributed_next=not_contributed_next,
         )
+        get_homepage_cache().set(key, version, page)
+        return add_cache_headers(Response(page), etag)
 
     return render_template("guest.html")
 
 
-@app.route("/login", methods=["GET", "POST"])
+@bp.route("/login", methods=["GET", "POST"])
 def login():
     """Displays login form and handles form response."""
     if "username" in session:
-        return redirect(url_for("index"))
+        return redirect(url_for("main.index"))
 
     # GET request: display the form
     if request.method == "GET":
@@ -70,17 +268,18 @@ def login():
 
     if authenticate_user(username, password):
         session["username"] = username
-        return redirect(url_for("index"))
+        session["user_id"] = get_user_id(username)
+        return redirect(url_for("main.index"))
 
     return render_template("login.html", error="Username or password incorrect")
 
 
-@app.route("/register", methods=["GET", "POST"])
+@bp.route("/register", methods=["GET", "POST"])
 def register():
     """Displays registration form and handles form response."""
 
     if "username" in session:
-        return redirect(url_for("index"))
+        return redirect(url_for("main.index"))
 
     # GET request: display the form
     if request.method == "GET":
@@ -96,24 +295,24 @@ def register():
         return render_template("register.html", errors=errors)
 
     # Maybe put a flash message here to confirm everything works
-    return redirect(url_for("login"))
+    return redirect(url_for("main.login"))
 
 
-@app.route("/logout")
+@bp.route("/logout")
 def logout():
     """Logs out the current user."""
 
-    if "username" in session:
-        del session["username"]
-    return redirect(url_for("index"))
+    session.pop("username", None)
+    session.pop("user_id", None)
+    return redirect(url_for("main.index"))
 
 
-@app.route("/new_story", methods=["GET", "POST"])
+@bp.route("/new_story", methods=["GET", "POST"])
 def new_story():
     """Allows user to create to a new story."""
 
     if "username" not in session:
-        return redirect(url_for("index"))
+        return redirect(url_for("main.index"))
 
     # GET request: display the form
     if request.method == "GET":
@@ -122,28 +321,48 @@ def new_story():
     # POST request: handle the form response and redirect
     created_story_title = request.form.get("title", default="")
     created_story_content = request.form.get("text", default="")
-    created_story_image = request.form.get("image", default="")
-    user_id = get_user_id(session["username"])
+    created_story_image = get_blob_store().externalize(
+        request.form.get("image", default="")
+    )
+    user_id = current_user_id()
 
-    story_id = STORY_DB.add_story(user_id, created_story_title)
-    STORY_DB.get_story(story_id).add_block(
-        user_id, created_story_content, created_story_image
+    story_id = get_story_db().create_story_with_block(
+        user_id, created_story_title, created_story_content, created_story_image
     )
 
-    return redirect(url_for("story", story_id=story_id))
+    return redirect(url_for("main.story", story_id=story_id))
+
 
+@bp.route("/search")
+def search():
+    """Searches story titles and blocks, showing the best matches first."""
 
-@app.route("/story/<story_id>", methods=["GET", "POST"])
+    if "username" not in session:
+        return redirect(url_for("main.index"))
+
+    query = request.args.get("q", default="")
+    page = request.args.get("page", default=0, type=int)
+    page = max(page, 0)
+    results, has_next = get_story_db().search(
+        query, page=page, limit=current_app.config["PAGE_SIZE"]
+    )
+    return render_template(
+        "search.html", query=query, results=results, page=page, has_next=has_next
+    )
+
+
+@bp.route("/story/<story_id>", methods=["GET", "POST"])
 def story(story_id):
     """Given a story_id, displays the full story if the user has already
     contributed to it or provides an append form to add to the existing story."""
 
     if "username" not in session:
-        return redirect(url_for("index"))
-    user_id = get_user_id(session["username"])
+        return redirect(url_for("main.index"))
+    user_id = current_user_id()
 
     # Make sure the story exists
-    story_obj = STORY_DB.get_story(story_id)
+    story_db = get_story_db()
+    story_obj = story_db.get_story(story_id)
     if not story_obj:
         return render_template(
             "error.html",
@@ -151,27 +370,74 @@ def story(story_id):
             error_msg="Sorry! This story was deleted or does not exist.",
         )
 
-    # View entire story if user has contributed
-    if STORY_DB.is_contributor(user_id, story_id):
-        contributors = list(map(get_username, story_obj.get_contributors()))
-        return render_template(
-            "view_story.html",
-            story_title=story_obj.title,
-            story_blocks=zip(contributors, story_obj.get_blocks()),
+    # Pages only change when blocks are added, or once the user joins
+    contributed = story_db.is_contributor(user_id, story_id)
+    if request.method == "GET":
+        etag = make_etag(
+            user_id,
+            story_id,
+            story_obj.num_blocks,
+            story_obj.last_block_id,
+            contributed,
         )
 
+        def last_modified():
+            timestamp = story_obj.last_block_timestamp
+            return timestamp and parse_timestamp(timestamp)
+
+        response = not_modified(etag, last_modified)
+        if response is not None:
+            return response
+
+    # View entire story if user has contributed
+    if contributed:
+        story_html = story_db.render_cache.get(story_obj.story_id, story_obj.version)
+        if story_html is not None:
+            response = Response(
+                render_template(
+                    "view_story.html",
+                    story_title=story_obj.title,
+                    story_fragments=[story_html],
+                )
+            )
+        else:
+            # Long stories are streamed so they never have to fit in memory
+            response = stream_template(
+                "view_story.html",
+                story_title=story_obj.title,
+                story_fragments=render_story_blocks(story_db, story_obj),
+            )
+        if request.method == "GET":
+            add_cache_headers(response, etag, last_modified())
+        return response
+
     # If user has not contributed, show append form
     if request.method == "GET":
         last_block = story_obj.last_block()
-        return render_template(
+        page = render_template(
             "append_story.html",
             story_id=story_id,
             story_title=story_obj.title,
             last_block=last_block,
         )
+        return add_cache_headers(Response(page), etag, last_modified())
 
     # Handle story append response
     new_block_text = request.form.get("text", default="")
-    new_block_img = request.form.get("image", default="")
+    new_block_img = get_blob_store().externalize(request.form.get("image", default=""))
     story_obj.add_block(user_id, new_block_text, new_block_img)
-    return redirect(url_for("story", story_id=story_id))
+    return redirect(url_for("main.story", story_id=story_id))
+
+
+@bp.route("/image/<name>")
+def image(name):
+    """Serves an image from the blob store. Its name is the hash of its
+    contents, so it can be cached forever."""
+    path = get_blob_store().path(name)
+    if path is None:
+        abort(404)
+    response = send_file(path, max_age=IMAGE_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    response.headers["X-Content-Type-Options"] = "nosniff"
+    return response
@@ -7,65 +7,168 @@
 Handles everything related to story/block database management.
 """
 
-from contextlib import contextmanager
+import random
+import re
+import secrets
 import sqlite3
+import time
+
+from app.db import get_pool
+from app.migrations import migrate
+
+# Columns of the stories table that are loaded into Story DAOs, in order
+STORY_COLUMNS = (
+    "story_id",
+    "creation_timestamp",
+    "creator_id",
+    "num_blocks",
+    "last_block_id",
+    "title",
+    # Copied from the last block by append_block
+    "last_block_text",
+    "last_block_img",
+    "last_block_timestamp",
+)
+STORY_SELECT = ", ".join(STORY_COLUMNS)
+
+# Maximum number of ids bound to one query by bulk loaders (SQLite limits the
+# number of parameters per statement)
+BULK_CHUNK_SIZE = 500
+
+# Number of rows fetched at a time by generators over large results
+ITER_BATCH_SIZE = 256
+
+# How many times a write transaction is retried when the database stays
+# locked for longer than busy_timeout, and the delay before the first retry
+# in seconds (doubled for each further retry).
+WRITE_RETRIES = 8
+WRITE_BACKOFF = 0.01
+
+# Pages of (story_id, creator_username, title, creation_timestamp) for the
+# stories a user has or hasn't contributed to, ordered by the keyset
+# (creation_timestamp, story_id) and starting after the given cursor.
+# The contributed list starts from the user's story_contributors rows (CROSS
+# JOIN fixes the join order), so its cost depends on how many stories they
+# joined, not on how many exist. The other list checks each story against
+# the same primary key.
+CONTRIBUTED_QUERY = """
+SELECT stories.story_id, users.username, stories.title, stories.creation_timestamp
+FROM story_contributors
+CROSS JOIN stories ON stories.story_id = story_contributors.story_id
+LEFT JOIN users ON users.user_id = stories.creator_id
+WHERE story_contributors.user_id = :user_id
+AND (stories.creation_timestamp, stories.story_id) > (:timestamp, :story_id)
+ORDER BY stories.creation_timestamp, stories.story_id
+LIMIT :limit
+"""
+
+NOT_CONTRIBUTED_QUERY = """
+SELECT stories.story_id, users.username, stories.title, stories.creation_timestamp
+FROM stories LEFT JOIN users ON users.user_id = stories.creator_id
+WHERE stories.num_blocks > 0
+AND (stories.creation_timestamp, stories.story_id) > (:timestamp, :story_id)
+AND NOT EXISTS (
+    SELECT TRUE FROM story_contributors
+    WHERE story_contributors.user_id = :user_id
+    AND story_contributors.story_id = stories.story_id
+)
+ORDER BY stories.creation_timestamp, stories.story_id
+LIMIT :limit
+"""
 
-SETUP_COMMANDS = """
-CREATE TABLE IF NOT EXISTS stories (
-    story_id            TEXT PRIMARY KEY DEFAULT (hex(randomblob(8))),
-    creation_timestamp  DATE DEFAULT CURRENT_TIMESTAMP,
-    creator_id          INTEGER,
-    num_blocks          INTEGER DEFAULT 0,
-    last_block_id       INTEGER,
-    title               TEXT
-);
-
-CREATE TABLE IF NOT EXISTS blocks (
-    block_id            TEXT PRIMARY KEY DEFAULT (hex(randomblob(8))),
-    creation_timestamp  DATE DEFAULT CURRENT_TIMESTAMP,
-    story_id            INTEGER,
-    author_id           INTEGER,
-    position            INTEGER,
-    block_text          TEXT,
-    block_img           TEXT
-);
+# Pages of (story_id, creator_username, title) for the stories whose title or
+# blocks match a full-text query, best match first. A story's score is its
+# best bm25 rank (lower is better) over its title and its blocks, with title
+# matches weighted more heavily. Only the :candidates newest matching titles
+# and blocks are ranked: FTS5 reads those straight from its index, whereas
+# ranking every match of a very common word would touch a large part of the
+# database. Searches matching fewer rows than that are ranked exactly.
+SEARCH_QUERY = """
+WITH hits(story_id, score) AS (
+    SELECT stories.story_id, title_hits.rank * :title_weight
+    FROM (
+        SELECT rowid, rank FROM stories_fts WHERE stories_fts MATCH :query
+        ORDER BY rowid DESC LIMIT :candidates
+    ) AS title_hits
+    CROSS JOIN stories ON stories.rowid = title_hits.rowid
+    UNION ALL
+    SELECT blocks.story_id, block_hits.rank
+    FROM (
+        SELECT rowid, rank FROM blocks_fts WHERE blocks_fts MATCH :query
+        ORDER BY rowid DESC LIMIT :candidates
+    ) AS block_hits
+    CROSS JOIN blocks ON blocks.rowid = block_hits.rowid
+)
+SELECT stories.story_id, users.username, stories.title
+FROM (SELECT story_id, MIN(score) AS score FROM hits GROUP BY story_id) AS ranked
+CROSS JOIN stories ON stories.story_id = ranked.story_id
+LEFT JOIN users ON users.user_id = stories.creator_id
+ORDER BY ranked.score, stories.story_id
+LIMIT :limit OFFSET :offset
 """
 
+# How much more a match in a story's title counts than one in its blocks
+SEARCH_TITLE_WEIGHT = 4.0
+
+# Maximum number of matching titles (and of matching blocks) ranked for one
+# search
+SEARCH_CANDIDATES = 2000
 
-class StoryDB:
+
+class StoryDB:  # pylint: disable=too-many-public-methods
     """An instance of this class would be used to interface with the database.
     Only one should be created per app instance."""
 
-    class Story:
+    class Story:  # pylint: disable=too-many-instance-attributes
         """This is a DAO (Data Access Object, i.e. a representation of data in
         the database). You can get these through `StoryDB.get_story(story_id)`"""
 
-        def __init__(self, db_obj, keys, values):
-            self.db_obj = db_obj
-            self.keys = keys
-            self.values = list(values)
-            # Allow for access of columns through dot syntax:
-            for k, v in zip(keys, values):
-                setattr(self, k, v)
-
-        def update_with(self, cur, values):
-            """Used as cur.row_factory."""
+        # Only these attributes can be set, so there is no per-object
+        # __dict__. Besides db_obj, each one is a column of STORY_COLUMNS.
+        __slots__ = ("db_obj",) + STORY_COLUMNS
 
-            for k, v in zip(cur.description, values):
-                k = k[0]
-                setattr(self, k, v)
-                self.values[self.keys.index(k)] = v
+        def __init__(self, db_obj, values):
+            self.db_obj = db_obj
+            self.load(values)
+
+        def load(self, values):
+            """Sets the columns from a row selected with STORY_COLUMNS."""
+            (
+                self.story_id,
+                self.creation_timestamp,
+                self.creator_id,
+                self.num_blocks,
+                self.last_block_id,
+                self.title,
+                self.last_block_text,
+                self.last_block_img,
+                self.last_block_timestamp,
+            ) = values
+
+        @property
+        def keys(self):
+            """The column names, in order."""
+            return STORY_COLUMNS
+
+        @property
+        def values(self):
+            """The column values, in order."""
+            return tuple(getattr(self, k) for k in STORY_COLUMNS)
+
+        @property
+        def version(self):
+            """(num_blocks, last_block_id), which changes whenever a block is
+            added. StoryDB.append_block returns the same stamps."""
+            return (self.num_blocks, self.last_block_id)
 
         @staticmethod
         def init_wrapper(db_obj):
-            """Returns a function that creates a Story from a cursor and tuple
-            of keys, but with `db_obj` already set to the given object. Used
-            for cur.row_factory."""
+            """Returns a function that creates a Story from a cursor and a row
+            of STORY_COLUMNS, but with `db_obj` already set to the given
+            object. Used for cur.row_factory."""
 
-            def factory(cur, values):
-                return StoryDB.Story(
-                    db_obj, tuple(t[0] for t in cur.description), values
-                )
+            def factory(_cur, values):
+                return StoryDB.Story(db_obj, values)
 
             return factory
 
@@ -73,7 +176,7 @@ class StoryDB:
             """Retrieves the list of user_id's of all users that contributed
             to this story, in order."""
 
-            with self.db_obj.connect() as cur:
+            with self.db_obj.read() as cur:
                 cur.execute(
                     "SELECT author_id FROM blocks WHERE story_id=? ORDER BY position",
                     (self.story_id,),
@@ -82,54 +185,81 @@ class StoryDB:
 
         def get_blocks(self):
             """Retrieves the list of text and images of all blocks with
-            this story_id, in order."""
+            this story_id, in order. Only the num_blocks blocks this object
+            knows about are read, so the result matches its version even if
+            blocks were appended since it was loaded."""
 
-            with self.db_obj.connect() as cur:
+            with self.db_obj.read() as cur:
                 cur.execute(
-                    "SELECT block_text, block_img FROM blocks WHERE story_id=? ORDER BY position",
-                    (self.story_id,),
+                    """SELECT block_text, block_img FROM blocks
+                    WHERE story_id=? AND position < ? ORDER BY position""",
+                    (self.story_id, self.num_blocks),
                 )
                 return cur.fetchall()
 
+        def iter_blocks(self):
+            """Yields (author_username, block_text, block_img) for each block
+            of this story, in order. The blocks are fetched in batches as the
+            generator is consumed, so memory use doesn't grow with the length
+            of the story. Like `get_blocks`, stops at this object's
+            num_blocks."""
+
+            with self.db_obj.read() as cur:
+                cur.execute(
+                    """SELECT users.username, blocks.block_text, blocks.block_img
+                    FROM blocks
+                    LEFT JOIN users ON users.user_id = blocks.author_id
+                    WHERE blocks.story_id=? AND blocks.position < ?
+                    ORDER BY blocks.position""",
+                    (self.story_id, self.num_blocks),
+                )
+                while True:
+                    rows = cur.fetchmany(ITER_BATCH_SIZE)
+                    if not rows:
+                        return
+                    yield from rows
+
         def add_block(self, author_id, block_text, block_img):
             """Adds a new block to this Story with the provided author_id and
-            block_text."""
-            with self.db_obj.connect() as cur:
-                cur.execute(
-                    """INSERT INTO blocks(story_id, author_id, position, block_text, block_img)
-                    VALUES (?, ?, ?, ?, ?)""",
-                    (self.story_id, author_id, self.num_blocks, block_text, block_img),
+            block_text, then reloads this Story as the append left it. Safe
+            to call concurrently from any number of threads and processes;
+            see StoryDB.append_block."""
+
+            def operation(cur):
+                versions = StoryDB.append_block(
+                    cur, self.story_id, author_id, block_text, block_img
                 )
-                self.num_blocks += 1
                 cur.execute(
-                    "SELECT block_id FROM blocks WHERE rowid=last_insert_rowid() LIMIT 1"
+                    f"SELECT {STORY_SELECT} FROM stories WHERE story_id=?",
+                    (self.story_id,),
                 )
-                # last_block_id will be added with setattr
-                self.last_block_id = cur.fetchone()[0]  # pylint: disable=W0201
-                cur.execute(
-                    "UPDATE stories SET num_blocks=?, last_block_id=? WHERE story_id=?",
-                    (self.num_blocks, self.last_block_id, self.story_id),
+                return versions, cur.fetchone()
+
+            (old_version, new_version), values = self.db_obj.queued_write(operation)
+            self.load(values)
+
+            render_cache = self.db_obj.render_cache
+            if render_cache is not None:
+                render_cache.append_block(
+                    self.story_id,
+                    old_version,
+                    new_version,
+                    (author_id, block_text, block_img),
                 )
-                # self.update()
 
         def last_block(self):
-            """Returns the text of the last block"""
-            with self.db_obj.connect() as cur:
-                cur.execute(
-                    """SELECT block_text, block_img FROM blocks
-                    WHERE story_id=? AND position=? LIMIT 1""",
-                    (self.story_id, self.num_blocks - 1),
-                )
-                last_block = cur.fetchone()
-                return (last_block[0], last_block[1])
+            """Returns the (text, image) of the last block. They are kept on
+            the story's row, so this doesn't query anything."""
+            return (self.last_block_text, self.last_block_img)
 
         def update(self):
             """Requests data from the database to update this object"""
-            with self.db_obj.connect() as cur:
-                cur.row_factory = self.update_with
+            with self.db_obj.read() as cur:
                 cur.execute(
-                    "SELECT * FROM stories WHERE story_id=? LIMIT 1", (self.story_id,)
-                ).fetchone()
+                    f"SELECT {STORY_SELECT} FROM stories WHERE story_id=? LIMIT 1",
+                    (self.story_id,),
+                )
+                self.load(cur.fetchone())
 
         def __repr__(self):
             return "Story(" + "|".join(map(repr, self.values)) + ")"
@@ -137,7 +267,17 @@ class StoryDB:
     def __init__(self, db_file):
         """Connects to the database and sets it up if necessary."""
         self.db_file = db_file
+        self.pool = get_pool(db_file)
         self.story_factory = StoryDB.Story.init_wrapper(self)
+        # Optional StoryRenderCache, kept up to date by Story.add_block
+        self.render_cache = None
+        # Optional AppendQueue that appends and new stories are written through
+        self.append_queue = None
+        # Pool that reads go to (see app.db.get_read_pool), and the one that
+        # listings and searches go to if they may be stale (see
+        # app.db.get_snapshot_pool). By default everything uses `pool`.
+        self.read_pool = self.pool
+        self.listing_pool = None
         # self.cur = self.con.cursor()
         # self.block_cur = self.con.cursor()
         # self.story_cur = self.con.cursor()
@@ -145,52 +285,156 @@ class StoryDB:
         # self.story_cur.row_factory = self.story_factory
         self.setup()
 
-    @contextmanager
     def connect(self):
         """Context manager for a connection & cursor simultaneously"""
-        with sqlite3.connect(self.db_file) as con:
-            cur = con.cursor()
-            yield cur
+        return self.pool.connect()
+
+    def read(self):
+        """Like `connect`, for reads only. The cursor may belong to a
+        read-only connection, which sees everything committed so far."""
+        return self.read_pool.connect()
+
+    def read_listing(self):
+        """Like `read`, for lists of stories, which may come from a snapshot
+        that is a few seconds old."""
+        return (self.listing_pool or self.read_pool).connect()
+
+    def write(self, operation):
+        """Runs `operation(cur)` in a write transaction and returns its result.
+
+        The transaction starts with BEGIN IMMEDIATE, which takes the write
+        lock before anything is read, so the operation sees the latest data
+        and no other writer can get in before it commits. If the lock can't
+        be had within busy_timeout, the whole transaction is retried with
+        exponential backoff."""
+        for attempt in range(WRITE_RETRIES + 1):
+            try:
+                with self.connect() as cur:
+                    cur.execute("BEGIN IMMEDIATE")
+                    return operation(cur)
+            except sqlite3.OperationalError as error:
+                if "database is locked" not in str(error) or attempt == WRITE_RETRIES:
+                    raise
+            time.sleep(WRITE_BACKOFF * 2**attempt * random.uniform(0.5, 1.5))
+        return None
+
+    def queued_write(self, operation):
+        """Like `write`, but goes through the append queue if there is one,
+        where the operation may share its transaction with other writes."""
+        if self.append_queue is not None:
+            return self.append_queue.write(operation)
+        return self.write(operation)
+
+    @staticmethod
+    def append_block(cur, story_id, author_id, block_text, block_img):
+        """Appends a block to a story. Must be run inside a write transaction
+        (see `write`). The position and counters come from the stories row
+        as it is inside the transaction, never from a possibly stale DAO.
+
+        Returns the story's (num_blocks, last_block_id) before and after."""
+        cur.execute(
+            "SELECT num_blocks, last_block_id FROM stories WHERE story_id=?",
+            (story_id,),
+        )
+        old_version = cur.fetchone()
+        if old_version is None:
+            raise ValueError(f"No story with id {story_id!r}")
+
+        cur.execute(
+            """INSERT INTO blocks(story_id, author_id, position, block_text, block_img)
+            SELECT story_id, ?, num_blocks, ?, ? FROM stories WHERE story_id=?""",
+            (author_id, block_text, block_img, story_id),
+        )
+        cur.execute("""SELECT block_id, creation_timestamp FROM blocks
+            WHERE rowid=last_insert_rowid()""")
+        block_id, timestamp = cur.fetchone()
+        cur.execute(
+            """UPDATE stories SET num_blocks=num_blocks + 1, last_block_id=?,
+            last_block_text=?, last_block_img=?, last_block_timestamp=?
+            WHERE story_id=?""",
+            (block_id, block_text, block_img, timestamp, story_id),
+        )
+        return old_version, (old_version[0] + 1, block_id)
 
     def setup(self):
-        """Runs database setup commands (creating tables).
+        """Runs database setup commands (creating tables and indexes).
         Should not fail if the database was already set up."""
         with self.connect() as cur:
-            cur.executescript(SETUP_COMMANDS)
+            migrate(cur)
 
     def add_story(self, creator_id, title):
         """Adds a story to the database and returns its story_id."""
         with self.connect() as cur:
-            cur.execute(
-                "INSERT INTO stories(creator_id, title) VALUES (?, ?)",
-                (creator_id, title),
-            )
-            cur.execute(
-                "SELECT story_id FROM stories WHERE rowid=last_insert_rowid() LIMIT 1"
-            )
-            return cur.fetchone()[0]
+            return StoryDB.insert_story(cur, creator_id, title)
+
+    def create_story_with_block(self, creator_id, title, block_text, block_img):
+        """Adds a story along with its first block, written by its creator,
+        and returns its story_id. Everything happens in one transaction, so
+        there is a single commit and nobody can see the story without its
+        first block."""
+
+        def operation(cur):
+            story_id = StoryDB.insert_story(cur, creator_id, title)
+            StoryDB.append_block(cur, story_id, creator_id, block_text, block_img)
+            return story_id
+
+        return self.queued_write(operation)
+
+    @staticmethod
+    def insert_story(cur, creator_id, title):
+        """Inserts a story row and returns its story_id. The id is generated
+        here (in the same format as the column default) so that it doesn't
+        have to be read back."""
+        story_id = secrets.token_hex(8).upper()
+        cur.execute(
+            "INSERT INTO stories(story_id, creator_id, title) VALUES (?, ?, ?)",
+            (story_id, creator_id, title),
+        )
+        return story_id
 
     def get_story(self, story_id):
         """Returns a Story DAO (Data access object) that
         represents a particular row of the stories table."""
-        with self.connect() as cur:
+        with self.read() as cur:
             cur.row_factory = self.story_factory
-            cur.execute("SELECT * FROM stories WHERE story_id=? LIMIT 1", (story_id,))
+            cur.execute(
+                f"SELECT {STORY_SELECT} FROM stories WHERE story_id=? LIMIT 1",
+                (story_id,),
+            )
             return cur.fetchone()
 
+    def get_stories(self, story_ids):
+        """Returns Story DAOs for many story_ids at once, in the same order
+        (ids that don't exist are skipped). The rows are fetched with one
+        query per BULK_CHUNK_SIZE ids rather than one per story."""
+        story_ids = list(story_ids)
+        stories = {}
+        with self.read() as cur:
+            cur.row_factory = self.story_factory
+            for i in range(0, len(story_ids), BULK_CHUNK_SIZE):
+                chunk = story_ids[i : i + BULK_CHUNK_SIZE]
+                cur.execute(
+                    f"""SELECT {STORY_SELECT} FROM stories
+                    WHERE story_id IN ({", ".join("?" * len(chunk))})""",
+                    chunk,
+                )
+                for story_obj in cur:
+                    stories[story_obj.story_id] = story_obj
+        return [stories[s] for s in story_ids if s in stories]
+
     def is_contributor(self, user_id, story_id):
         """Returns whether this user contributed to this story.
         The creator counts as a contributor."""
-        with self.connect() as cur:
+        with self.read() as cur:
             cur.execute(
-                "SELECT TRUE FROM blocks WHERE author_id=? AND story_id=? LIMIT 1",
+                "SELECT TRUE FROM story_contributors WHERE user_id=? AND story_id=?",
                 (user_id, story_id),
             )
             return bool(cur.fetchone())
 
     def is_creator(self, user_id, story_id):
         """Returns whether this user contributed to this story."""
-        with self.connect() as cur:
+        with self.read() as cur:
             cur.execute(
                 "SELECT TRUE FROM stories WHERE creator_id=? AND story_id=? LIMIT 1",
                 (user_id, story_id),
@@ -199,7 +443,7 @@ class StoryDB:
 
     def get_created_stories(self, user_id):
         """Returns list of story ids created by this user."""
-        with self.connect() as cur:
+        with self.read() as cur:
             cur.execute(
                 """SELECT story_id FROM stories WHERE user_id=?
                 ORDER BY creation_timestamp""",
@@ -210,23 +454,100 @@ class StoryDB:
     def get_contributed_stories(self, user_id):
         """Returns list of story ids contributed to by this user.
         The stories created by this user are included."""
-        with self.connect() as cur:
+        stories, _ = self.list_stories(user_id, contributed=True)
+        return [s[0] for s in stories]
+
+    def get_not_contributed_stories(self, user_id):
+        """Returns list of story ids not contributed to by this user."""
+        stories, _ = self.list_stories(user_id, contributed=False)
+        return [s[0] for s in stories]
+
+    def listing_version(self, user_id):
+        """Returns a value that changes whenever the stories listed for this
+        user by `list_stories` may have: when a story gets its first block or
+        the user joins one. Titles and usernames never change. Both events
+        are counted by triggers in the meta table, so this is one lookup."""
+        with self.read_listing() as cur:
             cur.execute(
-                """SELECT DISTINCT story_id FROM blocks WHERE author_id=?
-                ORDER BY creation_timestamp""",
+                """SELECT (SELECT value FROM meta WHERE name='story_version'),
+                (SELECT value FROM meta WHERE name='contributions:' || ?)""",
                 (user_id,),
             )
-            return [s[0] for s in cur.fetchall()]
+            return cur.fetchone()
 
-    def get_not_contributed_stories(self, user_id):
-        """Returns list of story ids not contributed to by this user."""
-        with self.connect() as cur:
+    def list_stories(self, user_id, contributed, after=None, limit=None):
+        """Returns a page of (story_id, creator_username, title) tuples for the
+        stories this user has (or, if `contributed` is false, hasn't)
+        contributed to, oldest first, along with the cursor for the next page
+        (None if this is the last one).
+
+        `after` is a cursor returned by a previous call, and `limit` is the
+        page size (all remaining stories if None). Each page is one query that
+        picks up where the last one left off, so the work done doesn't depend
+        on how far into the list the page is."""
+        timestamp, story_id = StoryDB.decode_cursor(after)
+        with self.read_listing() as cur:
+            cur.execute(
+                CONTRIBUTED_QUERY if contributed else NOT_CONTRIBUTED_QUERY,
+                {
+                    "user_id": user_id,
+                    "timestamp": timestamp,
+                    "story_id": story_id,
+                    # Fetch one extra row to find out if there's a next page
+                    "limit": -1 if limit is None else limit + 1,
+                },
+            )
+            rows = cur.fetchall()
+
+        next_cursor = None
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = StoryDB.encode_cursor(rows[-1][3], rows[-1][0])
+        return [row[:3] for row in rows], next_cursor
+
+    def search(self, text, page=0, limit=20):
+        """Returns a page of (story_id, creator_username, title) tuples for
+        the stories whose title or blocks contain every word of `text`, best
+        match first, along with whether there is a next page. `page` counts
+        from 0."""
+        query = StoryDB.make_fts_query(text)
+        if not query:
+            return [], False
+        with self.read_listing() as cur:
             cur.execute(
-                "SELECT DISTINCT story_id FROM blocks ORDER BY creation_timestamp"
+                SEARCH_QUERY,
+                {
+                    "query": query,
+                    "title_weight": SEARCH_TITLE_WEIGHT,
+                    "candidates": SEARCH_CANDIDATES,
+                    # Fetch one extra row to find out if there's a next page
+                    "limit": limit + 1,
+                    "offset": page * limit,
+                },
             )
-            return [
-                s[0] for s in cur.fetchall() if not self.is_contributor(user_id, s[0])
-            ]
+            rows = cur.fetchall()
+        return rows[:limit], len(rows) > limit
+
+    @staticmethod
+    def make_fts_query(text):
+        """Turns search box input into an FTS5 query matching all of its
+        words. Each word is quoted, so nothing the user types is interpreted
+        as FTS5 query syntax."""
+        return " ".join(f'"{word}"' for word in re.findall(r"\w+", text))
+
+    @staticmethod
+    def encode_cursor(timestamp, story_id):
+        """Returns a cursor pointing just after the given story."""
+        return f"{timestamp}_{story_id}"
+
+    @staticmethod
+    def decode_cursor(cursor):
+        """Returns the (creation_timestamp, story_id) keyset of a cursor.
+        Missing or malformed cursors point to the start of the list."""
+        if not cursor or "_" not in cursor:
+            return ("", "")
+        timestamp, story_id = cursor.rsplit("_", 1)
+        return (timestamp, story_id)
 
 
 # FOR TESTING PURPOSES (not part of the actual app)
@@ -240,7 +561,7 @@ if __name__ == "__main__":
     print(type(storyDAO))
 
     print(storyDAO)
-    print(storyDAO.full_text())
+    print(storyDAO.get_blocks())
 
     storyDAO.add_block(
         26_21_19_21_06,
@@ -249,11 +570,12 @@ Then I took a long time to get ready for school, so I left ~40 minutes late.
 I stood on the crowded S79, which is usually a 30 minute ride.
 This time it was about an hour long, due to heavy traffic and a different route.
 By the time I arrived at school, there was only 10 minutes left in 2nd period.""",
+        "",
     )
     storyDAO.update()
     print()
     print(storyDAO)
-    print(storyDAO.full_text())
+    print(storyDAO.get_blocks())
     print()
 
     storyDAO.add_block(
@@ -264,12 +586,13 @@ tell him what had happened. Instead I stayed near the 2nd floor atrium and
 chatted with a friend until 3rd period. We got cool new dry-erase whiteboard
 desks in that class. This story is going off topic. But they are pretty cool
 desks.""",
+        "",
     )
     storyDAO.update()
 
     print()
     print(storyDAO)
-    print(storyDAO.full_text())
+    print(storyDAO.get_blocks())
     print()
 
     print(storyDAO.last_block())
@@ -278,4 +601,9 @@ desks.""",
 
     import os
 
-    os.remove("TEMP_DB.db")
+    # The pool keeps its connections open (and with them the WAL files)
+    # until they are closed
+    db.pool.close_idle()
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists("TEMP_DB.db" + suffix):
+            os.remove("TEMP_DB.db" + suffix)
@@ -0,0 +1,9 @@
+# CircleTable — Christopher Liu, Yusuf Elsharawy, Deven Maheshwari, Naomi Naranjo
+# SoftDev
+# P00: CircleStories
+
+"""Benchmarks
+
+Scripts for measuring CircleStories performance. Run them from the
+repository root, e.g. `python3 -m benchmarks.pool_bench`.
+"""
@@ -0,0 +1,95 @@
+# CircleTable — Christopher Liu, Yusuf Elsharawy, Deven Maheshwari, Naomi Naranjo
+# SoftDev
+# P00: CircleStories
+
+"""Append Queue Benchmark
+
+Has a number of threads append blocks to random stories at once, three ways:
+each thread committing its own appends with synchronous=NORMAL (the default),
+the same with synchronous=FULL, and everything going through an AppendQueue
+(which commits with synchronous=FULL). Prints throughput and latency for each,
+and how many transactions the queue needed for its writes.
+"""
+
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+
+from app.append_queue import AppendQueue
+from app.storydb import StoryDB
+
+
+def appender(story_db, story_ids, appends, rng_seed, synchronous, latencies):
+    """Appends `appends` blocks to random stories, recording each latency."""
+    rng = random.Random(rng_seed)
+    # Held throughout, so the appends below run on the connection configured
+    # here (unless they go through the queue's writer thread)
+    with story_db.connect() as cur:
+        cur.execute(f"PRAGMA synchronous={synchronous}")
+        for i in range(appends):
+            story_obj = story_db.get_story(rng.choice(story_ids))
+            start = time.perf_counter()
+            story_obj.add_block(f"writer{rng_seed}", f"Block {i}", "")
+            latencies.append(time.perf_counter() - start)
+
+
+def run(mode, args):
+    """Runs one mode on a fresh database and prints its results."""
+    db_file = os.path.join(tempfile.mkdtemp(), "append.db")
+    story_db = StoryDB(db_file)
+    story_ids = [
+        story_db.create_story_with_block("writer0", f"Story {i}", "Once...", "")
+        for i in range(args.stories)
+    ]
+    synchronous = "NORMAL" if mode == "normal" else "FULL"
+    if mode == "queued":
+        story_db.append_queue = AppendQueue(story_db)
+
+    latencies = [[] for _ in range(args.threads)]
+    threads = [
+        threading.Thread(
+            target=appender,
+            args=(story_db, story_ids, args.appends, i, synchronous, latencies[i]),
+        )
+        for i in range(args.threads)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+
+    latencies = sorted(latency for thread in latencies for latency in thread)
+    print(
+        f"{mode:>8}: {len(latencies) / seconds:>7.0f} appends/sec, "
+        f"p50 {statistics.median(latencies) * 1000:.2f}ms, "
+        f"p99 {latencies[round(len(latencies) * 0.99) - 1] * 1000:.2f}ms"
+    )
+    if story_db.append_queue is not None:
+        queue = story_db.append_queue
+        queue.close()
+        print(
+            f"{'':>8}  {queue.writes} writes in {queue.transactions} transactions "
+            f"({queue.writes / queue.transactions:.1f} per commit)"
+        )
+
+
+def main():
+    """Parses the command line and runs every mode."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--appends", type=int, default=50, help="per thread")
+    parser.add_argument("--stories", type=int, default=100)
+    args = parser.parse_args()
+
+    for mode in ("normal", "full", "queued"):
+        run(mode, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+# CircleTable — Christopher Liu, Yusuf Elsharawy, Deven Maheshwari, Naomi Naranjo
+# SoftDev
+# P00: CircleStories
+
+"""Concurrent Append Stress Test
+
+Forks many writer processes that all append blocks to the same story at once,
+then checks that block positions are dense and unique and that the story's
+num_blocks and last_block_id agree with its blocks. Exits with an error if
+they don't.
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+from app.storydb import StoryDB
+
+
+def writer(db_file, story_id, writer_id, appends, start):
+    """Appends `appends` blocks to the story once `start` is set."""
+    story_obj = StoryDB(db_file).get_story(story_id)
+    start.wait()
+    for i in range(appends):
+        story_obj.add_block(f"writer{writer_id}", f"Block {i} by {writer_id}", "")
+
+
+def check(story_db, story_id, expected):
+    """Returns a list of problems with the story's blocks (empty if none)."""
+    problems = []
+    story_obj = story_db.get_story(story_id)
+    with story_db.connect() as cur:
+        positions = [
+            row[0]
+            for row in cur.execute(
+                "SELECT position FROM blocks WHERE story_id=? ORDER BY position",
+                (story_id,),
+            )
+        ]
+        last = cur.execute(
+            "SELECT block_id FROM blocks WHERE story_id=? AND position=?",
+            (story_id, expected - 1),
+        ).fetchone()
+
+    if positions != list(range(expected)):
+        problems.append(f"positions are not 0..{expected - 1}")
+    if story_obj.num_blocks != expected:
+        problems.append(f"num_blocks is {story_obj.num_blocks}, expected {expected}")
+    if last is None or story_obj.last_block_id != last[0]:
+        problems.append("last_block_id doesn't point at the last block")
+    return problems
+
+
+def main():
+    """Runs the stress test on a temporary database."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--writers", type=int, default=200)
+    parser.add_argument("--appends", type=int, default=5, help="per writer")
+    args = parser.parse_args()
+
+    db_file = os.path.join(tempfile.mkdtemp(), "stress.db")
+    story_db = StoryDB(db_file)
+    story_id = story_db.add_story("writer0", "Stress Test")
+
+    context = multiprocessing.get_context("fork")
+    start = context.Event()
+    processes = [
+        context.Process(target=writer, args=(db_file, story_id, i, args.appends, start))
+        for i in range(args.writers)
+    ]
+    for process in processes:
+        process.start()
+
+    began = time.perf_counter()
+    start.set()
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - began
+
+    expected = args.writers * args.appends
+    failed = [process for process in processes if process.exitcode != 0]
+    problems = check(story_db, story_id, expected)
+    if failed:
+        problems.append(f"{len(failed)} writers failed")
+
+    print(
+        f"{args.writers} writers appended {expected} blocks in {elapsed:.2f}s "
+        f"({expected / elapsed:.0f} appends/sec)"
+    )
+    for problem in problems:
+        print("FAILED:", problem)
+    if problems:
+        sys.exit(1)
+    print("Positions are dense and unique")
+
+
+if __name__ == "__main__":
+    main()
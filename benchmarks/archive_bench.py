@@ -0,0 +1,83 @@
+# CircleTable — Christopher Liu, Yusuf Elsharawy, Deven Maheshwari, Naomi Naranjo
+# SoftDev
+# P00: CircleStories
+
+"""Archive Round-Trip Benchmark
+
+Generates a corpus (a million blocks by default), exports it with
+`app.archive`, imports the archive into a new database and times both. Then
+checks that the copy has the same stories, blocks, contributors, last blocks
+and search results as the original, and exits with an error if it doesn't.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from app.archive import export_archive, import_archive, open_archive
+from app.storydb import StoryDB
+from benchmarks.corpus import seed_text
+
+# Compared between the original database and the imported copy
+CHECKS = (
+    "SELECT count(*), sum(num_blocks) FROM stories",
+    "SELECT count(*), sum(position) FROM blocks",
+    "SELECT typeof(story_id), count(*) FROM blocks GROUP BY 1",
+    "SELECT count(*) FROM story_contributors",
+    """SELECT story_id, num_blocks, last_block_id, last_block_text
+    FROM stories ORDER BY story_id""",
+)
+
+
+def fingerprint(story_db, words):
+    """Returns the results of CHECKS and of searching for each word."""
+    with story_db.connect() as cur:
+        results = [cur.execute(check).fetchall() for check in CHECKS]
+    return results + [story_db.search(word) for word in words]
+
+
+def main():
+    """Runs the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--stories", type=int, default=10000)
+    parser.add_argument("--blocks", type=int, default=100, help="per story")
+    parser.add_argument("--gzip", action="store_true", help="compress the archive")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    original = StoryDB(os.path.join(directory, "original.db"))
+    vocabulary = seed_text(original.db_file, args.stories, args.blocks)
+    archive = os.path.join(directory, "archive.jsonl" + (".gz" if args.gzip else ""))
+    num_blocks = args.stories * args.blocks
+
+    start = time.perf_counter()
+    with open_archive(archive, "w") as file:
+        export_archive(original, file)
+    elapsed = time.perf_counter() - start
+    print(
+        f"Exported {num_blocks} blocks in {elapsed:.1f}s "
+        f"({num_blocks / elapsed:.0f} blocks/sec, "
+        f"{os.path.getsize(archive) / 2**20:.0f} MiB)"
+    )
+
+    copy = StoryDB(os.path.join(directory, "copy.db"))
+    start = time.perf_counter()
+    with open_archive(archive, "r") as file:
+        import_archive(copy, file)
+    elapsed = time.perf_counter() - start
+    print(
+        f"Imported {num_blocks} blocks in {elapsed:.1f}s "
+        f"({num_blocks / elapsed:.0f} blocks/sec)"
+    )
+
+    words = vocabulary[:3] + vocabulary[1000:1003]
+    if fingerprint(copy, words) != fingerprint(original, words):
+        print("FAILED: the copy differs from the original")
+        sys.exit(1)
+    print("The copy matches the original")
+
+
+if __name__ == "__main__":
+    main()
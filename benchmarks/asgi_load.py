@@ -0,0 +1,139 @@
+# CircleTable — Christopher Liu, Yusuf Elsharawy, Deven Maheshwari, Naomi Naranjo
+# SoftDev
+# P00: CircleStories
+
+"""ASGI Load Test
+
+Drives the ASGI adapter in-process with a growing number of concurrent
+logged-in readers (homepage and story views) and reports requests/sec at each
+concurrency level, showing how one process scales with concurrent readers.
+The same is then done for homepage queries made through the async StoryDB
+facade directly.
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from urllib.parse import urlencode
+
+from app import create_app
+from app.aio import AsyncStoryDB
+from app.asgi import AsgiAdapter
+from app.auth import get_user_id
+from app.storydb import StoryDB
+from benchmarks.corpus import PASSWORD, seed
+
+
+async def asgi_request(asgi_app, method, path, headers=(), body=b""):
+    """Sends one request to an ASGI app and returns (status, headers, body)."""
+    path, _, query = path.partition("?")
+    scope = {
+        "type": "http",
+        "method": method,
+        "path": path,
+        "query_string": query.encode(),
+        "headers": list(headers),
+        "server": ("localhost", 80),
+    }
+    received = [{"type": "http.request", "body": body}]
+    response = {"body": b""}
+
+    async def receive():
+        if received:
+            return received.pop()
+        # Like a client that stays connected: nothing more until it leaves
+        await asyncio.get_running_loop().create_future()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+            response["headers"] = message["headers"]
+        else:
+            response["body"] += message.get("body", b"")
+
+    await asgi_app(scope, receive, send)
+    return response["status"], response["headers"], response["body"]
+
+
+async def login(asgi_app, username):
+    """Logs in and returns the session cookie header."""
+    _, headers, _ = await asgi_request(
+        asgi_app,
+        "POST",
+        "/login",
+        [(b"content-type", b"application/x-www-form-urlencoded")],
+        urlencode({"username": username, "password": PASSWORD}).encode(),
+    )
+    cookie = next(value for name, value in headers if name == b"set-cookie")
+    return (b"cookie", cookie.split(b";")[0])
+
+
+async def reader(asgi_app, cookie, paths, requests):
+    """Requests the given paths round-robin."""
+    for i in range(requests):
+        status, _, _ = await asgi_request(
+            asgi_app, "GET", paths[i % len(paths)], [cookie]
+        )
+        assert status == 200, status
+
+
+async def run(asgi_app, cookies, paths, concurrency, requests):
+    """Runs `concurrency` readers and returns the overall requests/sec."""
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(
+            reader(asgi_app, cookies[i % len(cookies)], paths, requests)
+            for i in range(concurrency)
+        )
+    )
+    return concurrency * requests / (time.perf_counter() - start)
+
+
+async def run_facade(async_db, user_ids, concurrency, requests):
+    """Like `run`, but each request is the homepage's two listing queries
+    made through the async StoryDB facade."""
+
+    async def facade_reader(user_id):
+        for _ in range(requests):
+            await async_db.list_stories(user_id, True, limit=20)
+            await async_db.list_stories(user_id, False, limit=20)
+
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(facade_reader(user_ids[i % len(user_ids)]) for i in range(concurrency))
+    )
+    return concurrency * requests / (time.perf_counter() - start)
+
+
+async def main(args):
+    """Seeds a temporary database and runs the load test against it."""
+    db_file = os.path.join(tempfile.mkdtemp(), "bench.db")
+    usernames = seed(db_file, args.users, args.stories)
+    application = AsgiAdapter(create_app({"DB_FILE": db_file}))
+    story_db = StoryDB(db_file)
+
+    cookies = [await login(application, username) for username in usernames]
+    story_ids, _ = story_db.list_stories(None, contributed=False, limit=20)
+    paths = ["/index"] + [f"/story/{story_id}" for story_id, _, _ in story_ids]
+
+    for concurrency in args.concurrency:
+        rate = await run(application, cookies, paths, concurrency, args.requests)
+        print(f"{concurrency:4} concurrent readers: {rate:8.1f} requests/sec")
+
+    async_db = AsyncStoryDB(story_db)
+    user_ids = [get_user_id(username) for username in usernames]
+    for concurrency in args.concurrency:
+        rate = await run_facade(async_db, user_ids, concurrency, args.requests)
+        print(f"{concurrency:4} concurrent facade readers: {rate:8.1f} homepages/sec")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--stories", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=20, help="per reader")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,150 @@
+# CircleTable — Christopher Liu, Yusuf Elsharawy, Deven Maheshwari, Naomi Naranjo
+# SoftDev
+# P00: CircleStories
+
+"""Corpus Generator
+
+Seeds a database with synthetic users, stories and blocks for benchmarking.
+"""
+
+import heapq
+import itertools
+import random
+
+from app import auth
+from app.storydb import StoryDB
+
+PASSWORD = "password"
+
+# Length of each generated block, in words
+WORDS_PER_BLOCK = 30
+
+# Syllables combined into the made-up words of generated text
+SYLLABLES = ("ka", "lo", "mi", "ren", "tu", "sa", "vel", "do", "ne", "ri", "pa", "zu")
+
+
+def seed(
+    db_file, num_users=50, num_stories=200, blocks_per_story=5, rng_seed=0, skew=0.0
+):
+    """Fills `db_file` with users and stories and returns the list of
+    usernames. Every story gets blocks from different randomly chosen users:
+    `blocks_per_story` each (at most one per user) if `skew` is 0.
+
+    With a positive `skew`, story lengths and user activity both follow
+    Zipf's law with that exponent, as they tend to on real sites: a few
+    stories get most of the blocks (`blocks_per_story` is then the average)
+    and a few users write most of them.
+
+    Every user has the same password hash, computed once, so that seeding
+    doesn't pay for a slow password hash per user."""
+
+    rng = random.Random(rng_seed)
+    auth.DB_FILE = db_file
+    auth.clear_user_cache()
+    story_db = StoryDB(db_file)
+
+    usernames = [f"user{i}" for i in range(num_users)]
+    password_hash = auth.hash_password(PASSWORD)
+    with story_db.connect() as cur:
+        cur.executemany(
+            "INSERT INTO users(username, password) VALUES (?, ?)",
+            ((username, password_hash) for username in usernames),
+        )
+    user_ids = [auth.get_user_id(username) for username in usernames]
+    user_weights = zipf_weights(num_users, skew)
+    rng.shuffle(user_weights)
+
+    story_weights = zipf_weights(num_stories, skew)
+    rng.shuffle(story_weights)
+    total_blocks = num_stories * blocks_per_story
+    for i, weight in enumerate(story_weights):
+        length = min(max(round(total_blocks * weight), 1), num_users)
+        authors = heapq.nlargest(
+            length,
+            range(num_users),
+            # Weighted sampling without replacement (Efraimidis & Spirakis)
+            key=lambda user: rng.random() ** (1 / user_weights[user]),
+        )
+
+        def operation(cur, i=i, authors=authors):
+            story_id = StoryDB.insert_story(cur, user_ids[authors[0]], f"Story {i}")
+            for position, author in enumerate(authors):
+                StoryDB.append_block(
+                    cur,
+                    story_id,
+                    user_ids[author],
+                    f"Block {position} of story {i}.",
+                    "",
+                )
+
+        story_db.write(operation)
+
+    return usernames
+
+
+def zipf_weights(count, exponent):
+    """Returns `count` weights following Zipf's law, largest first, adding up
+    to 1. They are all equal if `exponent` is 0."""
+    weights = [1 / rank**exponent for rank in range(1, count + 1)]
+    total = sum(weights)
+    return [weight / total for weight in weights]
+
+
+def make_vocabulary(size):
+    """Returns `size` distinct made-up words, shortest first."""
+    words = []
+    for length in itertools.count(1):
+        for parts in itertools.product(SYLLABLES, repeat=length):
+            words.append("".join(parts))
+            if len(words) == size:
+                return words
+    return words
+
+
+def seed_text(
+    db_file,
+    num_stories=10000,
+    blocks_per_story=100,
+    vocabulary_size=50000,
+    rng_seed=0,
+):
+    """Fills `db_file` with stories whose titles and blocks are random text,
+    with word frequencies following Zipf's law like natural language does.
+    Rows are inserted in bulk, so millions of blocks take minutes rather than
+    hours. Returns the vocabulary, most common word first."""
+
+    rng = random.Random(rng_seed)
+    vocabulary = make_vocabulary(vocabulary_size)
+    weights = list(
+        itertools.accumulate(1 / rank for rank in range(1, vocabulary_size + 1))
+    )
+
+    def text(num_words):
+        return " ".join(rng.choices(vocabulary, cum_weights=weights, k=num_words))
+
+    story_db = StoryDB(db_file)
+    for start in range(0, num_stories, 100):
+
+        def operation(cur, start=start):
+            for i in range(start, min(start + 100, num_stories)):
+                story_id = StoryDB.insert_story(cur, f"author{i % 97}", text(4))
+                cur.executemany(
+                    """INSERT INTO blocks (story_id, author_id, position, block_text)
+                    VALUES (?, ?, ?, ?)""",
+                    (
+                        (story_id, f"author{(i + j) % 97}", j, text(WORDS_PER_BLOCK))
+                        for j in range(blocks_per_story)
+                    ),
+                )
+                cur.execute(
+                    """UPDATE stories SET num_blocks=?,
+                    (last_block_id, last_block_text, last_block_img,
+                    last_block_timestamp) = (
+                        SELECT block_id, block_text, block_img, creation_timestamp
+                        FROM blocks WHERE story_id=? AND position=?
+                    ) WHERE story_id=?""",
+                    (blocks_per_story, story_id, blocks_per_story - 1, story_id),
+                )
+
+        story_db.write(operation)
+    return vocabulary
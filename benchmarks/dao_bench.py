@@ -0,0 +1,61 @@
+# CircleTable — Christopher Liu, Yusuf Elsharawy, Deven Maheshwari, Naomi Naranjo
+# SoftDev
+# P00: CircleStories
+
+"""Story DAO Microbenchmark
+
+Measures the cost of Story DAOs: building one from a row, the memory each one
+takes, and loading many stories one by one versus with get_stories.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+from app.storydb import STORY_SELECT, StoryDB
+
+
+def per_story(label, seconds, count):
+    """Prints a timing in microseconds per story."""
+    print(f"{label:>24}: {seconds / count * 1e6:8.2f} us/story")
+
+
+def main():
+    """Runs the benchmark on a temporary database."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--stories", type=int, default=5000)
+    args = parser.parse_args()
+
+    story_db = StoryDB(os.path.join(tempfile.mkdtemp(), "bench.db"))
+    story_ids = [
+        story_db.create_story_with_block("creator", f"Story {i}", "Once...", "")
+        for i in range(args.stories)
+    ]
+    with story_db.connect() as cur:
+        rows = cur.execute(f"SELECT {STORY_SELECT} FROM stories").fetchall()
+
+    start = time.perf_counter()
+    for row in rows:
+        story_db.story_factory(None, row)
+    per_story("build DAO from row", time.perf_counter() - start, len(rows))
+
+    tracemalloc.start()
+    daos = [story_db.story_factory(None, row) for row in rows]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f"{'memory per DAO':>24}: {size / len(daos):8.1f} bytes")
+
+    start = time.perf_counter()
+    for story_id in story_ids:
+        story_db.get_story(story_id)
+    per_story("get_story per id", time.perf_counter() - start, len(story_ids))
+
+    start = time.perf_counter()
+    story_db.get_stories(story_ids)
+    per_story("get_stories(ids)", time.perf_counter() - start, len(story_ids))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+# CircleTable — Christopher Liu, Yusuf Elsharawy, Deven Maheshwari, Naomi Naranjo
+# SoftDev
+# P00: CircleStories
+
+"""Load Test Suite
+
+Seeds a database (see `benchmarks.corpus.seed`), then has a number of
+concurrent virtual users drive the app through the Flask test client. Each
+virtual user is logged in as one of the seeded users and repeatedly picks a
+flow at random according to the mix: logging in again, loading the homepage,
+reading a story they joined, appending to one they haven't (the form, then
+the post) or starting a new story.
+
+Latency percentiles and throughput are printed per route and saved as JSON,
+along with the settings and the commit they were measured at. Everything is
+seeded, so runs with the same settings do the same work. Pass --compare with
+the JSON of an earlier run to see what changed:
+
+    python3 -m benchmarks.load_suite --output before.json
+    (change something)
+    python3 -m benchmarks.load_suite --output after.json --compare before.json
+"""
+
+import argparse
+from datetime import datetime, timezone
+import json
+import os
+import random
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+
+from app import auth, create_app
+from app.storydb import StoryDB
+from benchmarks.corpus import PASSWORD, seed
+
+DEFAULT_MIX = "login=5,index=35,view=35,append=15,new_story=10"
+
+
+class VirtualUser:
+    """One simulated user, with their own test client and random generator."""
+
+    def __init__(self, app, story_db, username, rng_seed):
+        self.client = app.test_client()
+        self.username = username
+        self.rng = random.Random(rng_seed)
+        self.latencies = {}
+        self.errors = {}
+
+        user_id = auth.get_user_id(username)
+        contributed, _ = story_db.list_stories(user_id, contributed=True)
+        not_contributed, _ = story_db.list_stories(user_id, contributed=False)
+        self.contributed = [story_id for story_id, _, _ in contributed]
+        self.not_contributed = [story_id for story_id, _, _ in not_contributed]
+        self.login()
+        # The first login is setup, not part of the run
+        self.latencies = {}
+
+    def request(self, route, method, path, data=None):
+        """Makes a request and records its latency under `route`."""
+        start = time.perf_counter()
+        response = self.client.open(path, method=method, data=data)
+        # Read the whole body, which matters for streamed pages
+        response.get_data()
+        self.latencies.setdefault(route, []).append(time.perf_counter() - start)
+        if response.status_code >= 400:
+            self.errors[route] = self.errors.get(route, 0) + 1
+        return response
+
+    def login(self):
+        """Logs out and back in."""
+        self.client.get("/logout")
+        self.request(
+            "login",
+            "POST",
+            "/login",
+            {"username": self.username, "password": PASSWORD},
+        )
+
+    def index(self):
+        """Loads the homepage."""
+        self.request("index", "GET", "/")
+
+    def view(self):
+        """Reads a story this user has joined."""
+        if not self.contributed:
+            self.new_story()
+            return
+        self.request("view", "GET", f"/story/{self.rng.choice(self.contributed)}")
+
+    def append(self):
+        """Opens the append form of a story this user hasn't joined, then
+        appends to it."""
+        if not self.not_contributed:
+            self.new_story()
+            return
+        story_id = self.not_contributed.pop(
+            self.rng.randrange(len(self.not_contributed))
+        )
+        self.request("append_form", "GET", f"/story/{story_id}")
+        self.request(
+            "append",
+            "POST",
+            f"/story/{story_id}",
+            {"text": f"{self.username} was here.", "image": ""},
+        )
+        self.contributed.append(story_id)
+
+    def new_story(self):
+        """Starts a new story."""
+        response = self.request(
+            "new_story",
+            "POST",
+            "/new_story",
+            {"title": f"{self.username}'s story", "text": "Once...", "image": ""},
+        )
+        self.contributed.append(response.headers["Location"].rsplit("/", 1)[-1])
+
+    def run(self, flows, weights, iterations):
+        """Runs `iterations` flows chosen at random."""
+        for flow in self.rng.choices(flows, weights, k=iterations):
+            getattr(self, flow)()
+
+
+def summarize(latencies, seconds):
+    """Returns the statistics of a list of latencies measured over a run that
+    took `seconds`."""
+    latencies = sorted(latencies)
+    return {
+        "count": len(latencies),
+        "throughput": len(latencies) / seconds,
+        "mean_ms": statistics.fmean(latencies) * 1000,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[max(round(len(latencies) * 0.99) - 1, 0)] * 1000,
+    }
+
+
+def current_commit():
+    """Returns the commit being benchmarked, or None outside of git."""
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip()
+
+
+def run(args):
+    """Seeds a database, runs the virtual users and returns the results."""
+    mix = dict(
+        (flow, float(weight))
+        for flow, weight in (item.split("=") for item in args.mix.split(","))
+    )
+    db_file = os.path.join(tempfile.mkdtemp(), "load.db")
+    config = {"DB_FILE": db_file}
+    if args.password_scheme:
+        config["PASSWORD_SCHEME"] = args.password_scheme
+    app = create_app(config)
+    # In the app's context, so that the users get its password scheme
+    with app.app_context():
+        usernames = seed(
+            db_file, args.users, args.stories, args.blocks, args.seed, args.skew
+        )
+    story_db = StoryDB(db_file)
+
+    virtual_users = [
+        VirtualUser(app, story_db, usernames[i % len(usernames)], args.seed + i)
+        for i in range(args.concurrency)
+    ]
+    threads = [
+        threading.Thread(
+            target=user.run, args=(list(mix), list(mix.values()), args.iterations)
+        )
+        for user in virtual_users
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+
+    return dict(
+        {
+            "commit": current_commit(),
+            "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "settings": vars(args),
+            "seconds": seconds,
+        },
+        **collect(virtual_users, seconds),
+    )
+
+
+def collect(virtual_users, seconds):
+    """Returns the statistics of every route, and of all of them together,
+    over a run that took `seconds`."""
+    by_route = {}
+    errors = {}
+    for user in virtual_users:
+        for route, latencies in user.latencies.items():
+            by_route.setdefault(route, []).extend(latencies)
+        for route, count in user.errors.items():
+            errors[route] = errors.get(route, 0) + count
+
+    return {
+        "routes": {
+            route: dict(summarize(latencies, seconds), errors=errors.get(route, 0))
+            for route, latencies in sorted(by_route.items())
+        },
+        "total": summarize(
+            [latency for latencies in by_route.values() for latency in latencies],
+            seconds,
+        ),
+    }
+
+
+def report(results, baseline=None):
+    """Prints the results, with the change from `baseline` if given."""
+    print(
+        f"{'route':>12} {'count':>7} {'req/s':>9} {'p50':>10} {'p99':>10} "
+        f"{'errors':>7}"
+    )
+    rows = dict(results["routes"], total=dict(results["total"], errors=0))
+    for route, stats in rows.items():
+        print(
+            f"{route:>12} {stats['count']:>7} {stats['throughput']:>9.1f} "
+            f"{stats['p50_ms']:>8.2f}ms {stats['p99_ms']:>8.2f}ms "
+            f"{stats['errors']:>7}"
+        )
+        if baseline is None:
+            continue
+        old = dict(baseline["routes"], total=baseline["total"]).get(route)
+        if old is not None:
+            print(
+                f"{'vs baseline':>12} {'':>7} "
+                f"{change(old['throughput'], stats['throughput']):>9} "
+                f"{change(old['p50_ms'], stats['p50_ms']):>10} "
+                f"{change(old['p99_ms'], stats['p99_ms']):>10}"
+            )
+
+
+def change(old, new):
+    """Formats the relative change from `old` to `new`."""
+    return f"{(new - old) / old:+.0%}" if old else "n/a"
+
+
+def main():
+    """Parses the command line, runs the suite and saves the results."""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--stories", type=int, default=1000)
+    parser.add_argument("--blocks", type=int, default=10, help="per story")
+    parser.add_argument("--skew", type=float, default=1.0, help="Zipf exponent")
+    parser.add_argument("--concurrency", type=int, default=8, help="virtual users")
+    parser.add_argument("--iterations", type=int, default=100, help="per user")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="flow=weight,...")
+    parser.add_argument("--password-scheme", help="e.g. pbkdf2_sha256$1000")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="load_results.json")
+    parser.add_argument("--compare", help="results of an earlier run")
+    args = parser.parse_args()
+
+    results = run(args)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf8") as file:
+            baseline = json.load(file)
+    report(results, baseline)
+
+    with open(args.output, "w", encoding="utf8") as file:
+        json.dump(results, file, indent=2)
+    print(f"Saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+# CircleTable — Christopher Liu, Yusuf Elsharawy, Deven Maheshwari, Naomi Naranjo
+# SoftDev
+# P00: CircleStories
+
+"""Login Throughput Benchmark
+
+For each password scheme, floods /login from many threads while one more
+thread keeps loading a page that doesn't hash anything, and reports login
+throughput and latency next to the other page's latency. Use it to choose the
+most expensive hashing cost that still fits the latency budget.
+"""
+
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+from app import auth, create_app
+from benchmarks.corpus import PASSWORD
+
+SCHEMES = (
+    "pbkdf2_sha256$100000",
+    "pbkdf2_sha256$200000",
+    "pbkdf2_sha256$600000",
+    "scrypt$16384$8$1",
+    "scrypt$32768$8$1",
+)
+
+
+def percentiles(latencies):
+    """Returns the p50 and p99 of a list of latencies, in milliseconds."""
+    latencies = sorted(latencies)
+    p99 = latencies[max(int(len(latencies) * 0.99) - 1, 0)]
+    return statistics.median(latencies) * 1000, p99 * 1000
+
+
+def hammer(app, path, data, stop, latencies):
+    """Requests `path` (POSTing `data` unless it's None) until `stop` is set,
+    recording each latency."""
+    client = app.test_client()
+    while not stop.is_set():
+        start = time.perf_counter()
+        if data is None:
+            client.get(path)
+        else:
+            client.post(path, data=data)
+            client.get("/logout")
+        latencies.append(time.perf_counter() - start)
+
+
+def run(scheme, threads, seconds):
+    """Benchmarks one scheme and prints its results."""
+    db_file = os.path.join(tempfile.mkdtemp(), "bench.db")
+    app = create_app({"DB_FILE": db_file, "PASSWORD_SCHEME": scheme})
+    app.test_client().get("/")
+    usernames = [f"user{i}" for i in range(threads)]
+    with app.app_context():
+        for username in usernames:
+            auth.create_user(username, PASSWORD, PASSWORD)
+
+    stop = threading.Event()
+    login_latencies = [[] for _ in usernames]
+    page_latencies = []
+    workers = [
+        threading.Thread(
+            target=hammer,
+            args=(app, "/login", {"username": u, "password": PASSWORD}, stop, l),
+        )
+        for u, l in zip(usernames, login_latencies)
+    ]
+    workers.append(
+        threading.Thread(target=hammer, args=(app, "/", None, stop, page_latencies))
+    )
+    for worker in workers:
+        worker.start()
+    time.sleep(seconds)
+    stop.set()
+    for worker in workers:
+        worker.join()
+
+    report(
+        scheme,
+        [latency for latencies in login_latencies for latency in latencies],
+        page_latencies,
+        seconds,
+    )
+
+
+def report(scheme, login_latencies, page_latencies, seconds):
+    """Prints one row of results."""
+    login_p50, login_p99 = percentiles(login_latencies)
+    page_p50, page_p99 = percentiles(page_latencies)
+    print(
+        f"{scheme:>22} {len(login_latencies) / seconds:>8.1f}/s {login_p50:>8.1f}ms "
+        f"{login_p99:>8.1f}ms {page_p50:>8.1f}ms {page_p99:>8.1f}ms"
+    )
+
+
+def main():
+    """Runs the benchmark for every scheme."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--schemes", nargs="+", default=SCHEMES)
+    parser.add_argument("--threads", type=int, default=16, help="logging in")
+    parser.add_argument("--seconds", type=float, default=5)
+    args = parser.parse_args()
+
+    print(
+        f"{'scheme':>22} {'logins':>10} {'login p50':>10} {'login p99':>10} "
+        f"{'page p50':>10} {'page p99':>10}"
+    )
+    print(f"(password hashing pool: {auth.KDF_WORKERS} threads)")
+    for scheme in args.schemes:
+        run(scheme, args.threads, args.seconds)
+
+
+if __name__ == "__main__":
+    main()
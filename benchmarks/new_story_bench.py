@@ -0,0 +1,56 @@
+# CircleTable — Christopher Liu, Yusuf Elsharawy, Deven Maheshwari, Naomi Naranjo
+# SoftDev
+# P00: CircleStories
+
+"""New Story Benchmark
+
+Compares creating a story with add_story, get_story and add_block (three
+transactions) against create_story_with_block (one transaction), reporting
+commits and latency per story.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from app.storydb import StoryDB
+
+
+def separate(story_db, i):
+    """The old way of creating a story."""
+    story_id = story_db.add_story("creator", f"Story {i}")
+    story_db.get_story(story_id).add_block("creator", "Once upon a time...", "")
+
+
+def batched(story_db, i):
+    """Creating a story in one transaction."""
+    story_db.create_story_with_block("creator", f"Story {i}", "Once upon a time...", "")
+
+
+def main():
+    """Times both ways of creating stories on a temporary database."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--stories", type=int, default=500)
+    args = parser.parse_args()
+
+    story_db = StoryDB(os.path.join(tempfile.mkdtemp(), "bench.db"))
+    con = story_db.pool.get()
+    for label, create in (("separate", separate), ("batched", batched)):
+        statements = []
+        con.set_trace_callback(statements.append)
+        start = time.perf_counter()
+        for i in range(args.stories):
+            create(story_db, i)
+        elapsed = time.perf_counter() - start
+        con.set_trace_callback(None)
+
+        commits = statements.count("COMMIT") / args.stories
+        print(
+            f"{label:>9}: {commits:.1f} commits/story, "
+            f"{elapsed / args.stories * 1000:.3f} ms/story"
+        )
+
+
+if __name__ == "__main__":
+    main()
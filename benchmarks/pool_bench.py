@@ -0,0 +1,102 @@
+# CircleTable — Christopher Liu, Yusuf Elsharawy, Deven Maheshwari, Naomi Naranjo
+# SoftDev
+# P00: CircleStories
+
+"""Connection Pool Benchmark
+
+Serves the app from a threaded development server (a new thread for every
+request, like `circlestories.py`) and has a few clients log in and then load
+their homepage over HTTP, with and without the shared connection pool.
+Reports connections opened per request (logins included) and homepages/sec.
+"""
+
+import argparse
+import http.client
+import logging
+import os
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode
+
+from werkzeug.serving import make_server
+
+from app import create_app, db
+from benchmarks.corpus import PASSWORD, seed
+
+
+def client(port, username, requests):
+    """Logs in and then loads the homepage `requests` times."""
+    con = http.client.HTTPConnection("127.0.0.1", port)
+    con.request(
+        "POST",
+        "/login",
+        urlencode({"username": username, "password": PASSWORD}),
+        {"Content-Type": "application/x-www-form-urlencoded"},
+    )
+    response = con.getresponse()
+    response.read()
+    cookie = response.getheader("Set-Cookie").split(";")[0]
+    for _ in range(requests):
+        con.request("GET", "/", headers={"Cookie": cookie})
+        response = con.getresponse()
+        response.read()
+        assert response.status == 200, response.status
+    con.close()
+
+
+def run(db_file, usernames, pooled, args):
+    """Serves a login and `args.requests` homepages to each of
+    `args.clients` clients and returns (connections per request,
+    homepages/sec)."""
+    pool = db.POOLS[db_file] = db.ConnectionPool(db_file, pooled=pooled)
+    # Every homepage is rendered from the database
+    app = create_app({"DB_FILE": db_file, "HOMEPAGE_CACHE_SIZE": 0})
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.start()
+
+    opened = pool.connections_opened
+    clients = [
+        threading.Thread(target=client, args=(server.port, usernames[i], args.requests))
+        for i in range(args.clients)
+    ]
+    start = time.perf_counter()
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+    server_thread.join()
+
+    homepages = args.clients * args.requests
+    connections = pool.connections_opened - opened
+    return connections / (homepages + args.clients), homepages / elapsed
+
+
+def main():
+    """Seeds a temporary database and prints the comparison."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--stories", type=int, default=200)
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=50, help="per client")
+    args = parser.parse_args()
+    # The server would log every request
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "bench.db")
+        usernames = seed(db_file, args.users, args.stories)
+
+        for label, pooled in (("before (no pool)", False), ("after (pooled)", True)):
+            connections, rate = run(db_file, usernames, pooled, args)
+            print(
+                f"{label:>18}: {connections:8.2f} connections/request, "
+                f"{rate:8.1f} homepages/sec"
+            )
+
+
+if __name__ == "__main__":
+    main()
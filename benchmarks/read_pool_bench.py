@@ -0,0 +1,121 @@
+# CircleTable — Christopher Liu, Yusuf Elsharawy, Deven Maheshwari, Naomi Naranjo
+# SoftDev
+# P00: CircleStories
+
+"""Read Pool Benchmark
+
+Seeds a database, then runs reader threads that load homepages and read whole
+stories while one writer thread keeps appending, for a few seconds each with
+reads going to the primary connections, to read-only connections, and (for
+the homepage lists) to a snapshot. Prints the throughput of the readers (in
+pages read) and of the writer, and the writer's p99 latency.
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+from app import auth
+from app.db import get_read_pool, get_snapshot_pool
+from app.storydb import StoryDB
+from benchmarks.corpus import seed
+
+
+def reader(story_db, user_ids, story_ids, rng_seed, stop, counts):
+    """Reads a homepage's lists and then a whole story until `stop` is set,
+    counting the pages read."""
+    rng = random.Random(rng_seed)
+    while not stop.is_set():
+        user_id = rng.choice(user_ids)
+        story_db.listing_version(user_id)
+        story_db.list_stories(user_id, contributed=True, limit=20)
+        story_db.list_stories(user_id, contributed=False, limit=20)
+        story_obj = story_db.get_story(rng.choice(story_ids))
+        for _ in story_obj.iter_blocks():
+            pass
+        counts.append(2)
+
+
+def writer(story_db, user_ids, story_ids, stop, latencies):
+    """Appends to random stories until `stop` is set."""
+    rng = random.Random(-1)
+    while not stop.is_set():
+        story_obj = story_db.get_story(rng.choice(story_ids))
+        start = time.perf_counter()
+        story_obj.add_block(rng.choice(user_ids), "Another block.", "")
+        latencies.append(time.perf_counter() - start)
+
+
+def run(story_db, user_ids, story_ids, args):
+    """Runs the readers and the writer for `args.seconds` and returns
+    (pages/sec, appends/sec, append p99 in ms)."""
+    stop = threading.Event()
+    counts = []
+    latencies = []
+    threads = [
+        threading.Thread(
+            target=reader, args=(story_db, user_ids, story_ids, i, stop, counts)
+        )
+        for i in range(args.readers)
+    ]
+    threads.append(
+        threading.Thread(
+            target=writer, args=(story_db, user_ids, story_ids, stop, latencies)
+        )
+    )
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    latencies.sort()
+    return (
+        sum(counts) / args.seconds,
+        len(latencies) / args.seconds,
+        latencies[round(len(latencies) * 0.99) - 1] * 1000 if latencies else 0,
+    )
+
+
+def main():
+    """Seeds a temporary database and prints the comparison."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--stories", type=int, default=2000)
+    parser.add_argument("--blocks", type=int, default=20, help="per story")
+    parser.add_argument("--readers", type=int, default=8, help="threads")
+    parser.add_argument("--seconds", type=float, default=5.0, help="per mode")
+    parser.add_argument("--snapshot-age", type=float, default=1.0)
+    args = parser.parse_args()
+
+    db_file = os.path.join(tempfile.mkdtemp(), "read.db")
+    usernames = seed(db_file, args.users, args.stories, args.blocks, skew=1.0)
+    story_db = StoryDB(db_file)
+    user_ids = [auth.get_user_id(username) for username in usernames]
+    with story_db.connect() as cur:
+        story_ids = [row[0] for row in cur.execute("SELECT story_id FROM stories")]
+
+    modes = (
+        ("primary", story_db.pool, None),
+        ("read-only", get_read_pool(db_file), None),
+        (
+            "snapshot",
+            get_read_pool(db_file),
+            get_snapshot_pool(db_file, args.snapshot_age),
+        ),
+    )
+    print(f"{'mode':>10} {'pages/s':>9} {'appends/s':>10} {'append p99':>11}")
+    for name, read_pool, listing_pool in modes:
+        story_db.read_pool = read_pool
+        story_db.listing_pool = listing_pool
+        reads, appends, p99 = run(story_db, user_ids, story_ids, args)
+        print(f"{name:>10} {reads:>9.0f} {appends:>10.0f} {p99:>9.2f}ms")
+    print(f"Snapshots taken: {get_snapshot_pool(db_file).refreshes}")
+
+
+if __name__ == "__main__":
+    main()
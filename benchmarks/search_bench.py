@@ -0,0 +1,79 @@
+# CircleTable — Christopher Liu, Yusuf Elsharawy, Deven Maheshwari, Naomi Naranjo
+# SoftDev
+# P00: CircleStories
+
+"""Full-Text Search Benchmark
+
+Generates a corpus of random text (a million blocks by default) and times
+searches for common, mid-frequency and rare words and for multi-word queries.
+Pass --db to reuse a corpus generated by an earlier run.
+"""
+
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from app.storydb import StoryDB
+from benchmarks.corpus import make_vocabulary, seed_text
+
+
+def time_searches(story_db, queries, pages):
+    """Returns the sorted latencies in milliseconds of running every query
+    and reading its first `pages` pages."""
+    latencies = []
+    for query in queries:
+        for page in range(pages):
+            start = time.perf_counter()
+            story_db.search(query, page=page)
+            latencies.append((time.perf_counter() - start) * 1000)
+    return sorted(latencies)
+
+
+def main():
+    """Runs the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--db", help="corpus to reuse or create")
+    parser.add_argument("--stories", type=int, default=10000)
+    parser.add_argument("--blocks", type=int, default=100, help="per story")
+    parser.add_argument("--vocabulary", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=50, help="per kind")
+    args = parser.parse_args()
+
+    db_file = args.db or os.path.join(tempfile.mkdtemp(), "search.db")
+    if os.path.exists(db_file):
+        vocabulary = make_vocabulary(args.vocabulary)
+    else:
+        start = time.perf_counter()
+        vocabulary = seed_text(db_file, args.stories, args.blocks, args.vocabulary)
+        print(
+            f"Generated {args.stories * args.blocks} blocks "
+            f"in {time.perf_counter() - start:.0f}s"
+        )
+
+    story_db = StoryDB(db_file)
+    rng = random.Random(1)
+    kinds = {
+        "common word": [rng.choice(vocabulary[:20]) for _ in range(args.queries)],
+        "mid word": [rng.choice(vocabulary[500:2000]) for _ in range(args.queries)],
+        "rare word": [rng.choice(vocabulary[-5000:]) for _ in range(args.queries)],
+        "two words": [
+            f"{rng.choice(vocabulary[:200])} {rng.choice(vocabulary[:2000])}"
+            for _ in range(args.queries)
+        ],
+    }
+
+    print(f"{'query':>12} {'p50':>9} {'p99':>9} {'max':>9}")
+    for kind, queries in kinds.items():
+        latencies = time_searches(story_db, queries, pages=3)
+        p99 = latencies[int(len(latencies) * 0.99) - 1]
+        print(
+            f"{kind:>12} {statistics.median(latencies):>7.1f}ms "
+            f"{p99:>7.1f}ms {latencies[-1]:>7.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
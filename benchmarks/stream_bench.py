@@ -0,0 +1,76 @@
+# CircleTable — Christopher Liu, Yusuf Elsharawy, Deven Maheshwari, Naomi Naranjo
+# SoftDev
+# P00: CircleStories
+
+"""Story View Streaming Benchmark
+
+Builds stories of increasing length and measures, for an uncached view of
+each, the time to the first byte of the response, the total time, and the
+peak memory allocated while the page is sent.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+from app import auth, create_app
+from app.storydb import StoryDB
+from benchmarks.corpus import PASSWORD
+
+
+def build_story(story_db, user_id, num_blocks):
+    """Creates a story with `num_blocks` blocks in a single transaction."""
+
+    def operation(cur):
+        story_id = StoryDB.insert_story(cur, user_id, f"{num_blocks} blocks")
+        for i in range(num_blocks):
+            StoryDB.append_block(cur, story_id, user_id, f"Block number {i}. " * 8, "")
+        return story_id
+
+    return story_db.write(operation)
+
+
+def main():
+    """Runs the benchmark on a temporary database."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--lengths", type=int, nargs="+", default=[100, 1000, 10000, 40000]
+    )
+    args = parser.parse_args()
+
+    db_file = os.path.join(tempfile.mkdtemp(), "bench.db")
+    # A tiny render cache, so that every view renders the story from scratch
+    app = create_app({"DB_FILE": db_file, "RENDER_CACHE_SIZE": 1})
+    client = app.test_client()
+    client.get("/")
+    with app.app_context():
+        auth.create_user("reader", PASSWORD, PASSWORD)
+        user_id = auth.get_user_id("reader")
+    client.post("/login", data={"username": "reader", "password": PASSWORD})
+    story_db = StoryDB(db_file)
+
+    print(f"{'blocks':>8} {'first byte':>12} {'total':>10} {'peak memory':>12}")
+    for num_blocks in args.lengths:
+        story_id = build_story(story_db, user_id, num_blocks)
+        tracemalloc.start()
+        start = time.perf_counter()
+        response = client.get(f"/story/{story_id}", buffered=False)
+        chunks = iter(response.response)
+        next(chunks)
+        first_byte = time.perf_counter() - start
+        for _ in chunks:
+            pass
+        total = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        response.close()
+        print(
+            f"{num_blocks:>8} {first_byte * 1000:>10.1f}ms {total * 1000:>8.0f}ms "
+            f"{peak / 1024:>10.0f}KiB"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -3,4 +3,78 @@
 # P00
 # 2021-10-27
 
-from app import app
+"""Launches CircleStories.
+
+With --workers N, the listening socket is opened once and N worker processes
+are forked to serve it, each with its own copy of the app. All of them share
+one secret key so that sessions work whichever worker gets the request.
+Otherwise the Flask development server is used.
+
+The app can also be run by other WSGI servers through its factory, e.g.
+`gunicorn "app:create_app()"`.
+"""
+
+import argparse
+import os
+import signal
+import socket
+
+from werkzeug.serving import make_server
+
+from app import create_app
+
+
+def serve_workers(config, host, port, workers):
+    """Serves the app from `workers` forked processes sharing one socket."""
+    sock = socket.create_server((host, port))
+    sock.set_inheritable(True)
+
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            # Each worker builds its own app (and database connections)
+            server = make_server(
+                host, port, create_app(config), threaded=True, fd=sock.fileno()
+            )
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            os._exit(0)  # pylint: disable=protected-access
+        children.append(pid)
+
+    print(f"Serving on http://{host}:{port}/ with {workers} workers")
+    try:
+        for pid in children:
+            os.waitpid(pid, 0)
+    except KeyboardInterrupt:
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+
+
+def main():
+    """Parses the command line and starts the server."""
+    parser = argparse.ArgumentParser(description="Run CircleStories.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=0, help="worker processes")
+    parser.add_argument("--db", help="database file (default: circlestories.db)")
+    parser.add_argument("--debug", action="store_true", help="never use in prod")
+    args = parser.parse_args()
+
+    config = {}
+    if args.db:
+        config["DB_FILE"] = args.db
+
+    if args.workers:
+        # Without a configured key, generate one now so every worker shares it
+        if "CIRCLESTORIES_SECRET_KEY" not in os.environ:
+            config["SECRET_KEY"] = os.urandom(32)
+        serve_workers(config, args.host, args.port, args.workers)
+    else:
+        create_app(config).run(host=args.host, port=args.port, debug=args.debug)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,2 +1,3 @@
 black --check app && \
-pylint app
+pylint app && \
+python3 -m app.query_plans